@@ -1,13 +1,46 @@
 """simple api for chat interface"""
 
+import json
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, generate_latest
 from pydantic import BaseModel
 
-from rag.rag_chain import RAGChain
+from rag.metrics import LatencyStats, RAGCollector
+from rag.rag_chain import AsyncRAGChain
+
+# startup messages (model pulls, warm-up time) go through logging
+logging.basicConfig(level=logging.INFO)
+
+# per-request latencies of the streaming endpoint
+latency = {
+    "retrieval": LatencyStats(),
+    "time_to_first_token": LatencyStats(),
+    "generation": LatencyStats(),
+    "total": LatencyStats(),
+}
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # one rag chain, and so one pooled client per service, for the process
+    app.state.rag = AsyncRAGChain()
+    collector = RAGCollector(app.state.rag)
+    REGISTRY.register(collector)
+    await app.state.rag.start()
+    yield
+    REGISTRY.unregister(collector)
+    await app.state.rag.close()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # enable cors for frontend
 app.add_middleware(
@@ -20,21 +53,104 @@ app.add_middleware(
 
 class QueryRequest(BaseModel):
     question: str
+    top_k: int = 3
+    source_filter: Optional[str] = None
+    # include per-stage milliseconds in the response
+    timings: bool = False
 
 
 class QueryResponse(BaseModel):
     answer: str
     sources: list
+    cached: bool = False
 
 
-# initialize rag chain
-rag = RAGChain()
+@app.post("/api/query")
+async def query(request: Request, body: QueryRequest):
+    result = await request.app.state.rag.query(
+        body.question, top_k=body.top_k, source_filter=body.source_filter
+    )
+    response = {
+        "answer": result["answer"],
+        "sources": result["sources"],
+        "cached": result["cached"],
+    }
+    if body.timings:
+        response["timings"] = result["timings"]
+    return response
 
 
-@app.post("/api/query")
-async def query(request):
-    result = rag.query(request.question)
-    return {"answer": result["answer"], "sources": result["sources"]}
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.post("/api/query/stream")
+async def query_stream(request: Request, body: QueryRequest):
+    """server-sent events: sources right after retrieval, then tokens"""
+    start = time.perf_counter()
+    result = await request.app.state.rag.query(
+        body.question, top_k=body.top_k, source_filter=body.source_filter, stream=True
+    )
+    retrieved = time.perf_counter()
+
+    async def events():
+        tokens = result["answer"]
+        first_token = None
+        completed = False
+
+        try:
+            yield sse("sources", {"sources": result["sources"]})
+
+            async for token in tokens:
+                if await request.is_disconnected():
+                    return
+                if first_token is None:
+                    first_token = time.perf_counter()
+                yield sse("token", {"token": token})
+            completed = True
+
+            timings = {
+                "retrieval": retrieved - start,
+                "time_to_first_token": (first_token or time.perf_counter()) - start,
+                "total": time.perf_counter() - start,
+                "cached": result["cached"],
+            }
+            if body.timings:
+                timings["stages_ms"] = result["timings"]
+            yield sse("done", timings)
+
+        finally:
+            # closing the stream stops ollama generating for a gone client
+            await tokens.aclose()
+
+            end = time.perf_counter()
+            latency["retrieval"].record(retrieved - start)
+            if first_token is not None:
+                latency["time_to_first_token"].record(first_token - start)
+            if completed:
+                latency["generation"].record(end - retrieved)
+                latency["total"].record(end - start)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/stats")
+async def stats(request: Request):
+    summary = {name: values.summary() for name, values in latency.items()}
+    summary["context"] = request.app.state.rag.context_builder.stats()
+    summary["llm"] = request.app.state.rag.llm.stats()
+    summary["answer_cache"] = request.app.state.rag.answer_cache.stats()
+    return summary
+
+
+@app.get("/metrics")
+async def metrics():
+    # prometheus scrape: stage histograms, error counters, cache hits, fallbacks
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+"""chunks/sec and peak memory of the native chunker against the langchain splitters"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from rag.chunker import Document
+from rag.document_loader import DocumentLoader
+
+
+def make_loader(chunker, workers):
+    os.environ["CHUNKER"] = chunker
+    os.environ["CHUNK_WORKERS"] = str(workers)
+    return DocumentLoader()
+
+
+def run(loader, documents):
+    start = time.perf_counter()
+    chunks = loader.chunk_documents(documents)
+    elapsed = time.perf_counter() - start
+
+    # separate pass, tracing slows allocation-heavy code down
+    tracemalloc.start()
+    loader.chunk_documents(documents)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return chunks, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=20, help="copies of the corpus to chunk")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    base = make_loader("native", 1).load_documents()
+    documents = [
+        Document(doc.page_content, {**doc.metadata, "file_name": f"{i}_{doc.metadata['file_name']}"})
+        for i in range(args.repeat)
+        for doc in base
+    ]
+    size_mb = sum(len(doc.page_content) for doc in documents) / 1e6
+    print(f"{len(documents)} files, {size_mb:.1f} MB of markdown")
+
+    modes = [("native", 1)]
+    try:
+        import langchain_text_splitters  # noqa: F401
+
+        modes.insert(0, ("langchain", 1))
+    except ImportError:
+        print("langchain-text-splitters is not installed, skipping the langchain comparison")
+    if args.workers > 1:
+        modes.append(("native", args.workers))
+
+    print(f"{'chunker':>14} {'chunks':>8} {'seconds':>8} {'chunks/s':>10} {'peak MB':>8}")
+
+    reference = None
+    for chunker, workers in modes:
+        loader = make_loader(chunker, workers)
+        # first call starts the pool, keep that out of the timing
+        loader.chunk_documents(documents[:1])
+
+        chunks, elapsed, peak = run(loader, documents)
+        loader.close()
+
+        # pool workers allocate in their own processes, so only the
+        # parent's share is traced there
+        name = chunker if workers == 1 else f"{chunker}/{workers}"
+        print(
+            f"{name:>14} {len(chunks):>8} {elapsed:>8.2f} "
+            f"{len(chunks) / elapsed:>10.0f} {peak / 1e6:>8.1f}"
+        )
+
+        output = [(chunk.page_content, chunk.metadata) for chunk in chunks]
+        if reference is None:
+            reference = output
+        elif output != reference:
+            print(f"{'':>14} output differs from {modes[0][0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""deterministic local stand-ins for cohere and ollama, with configurable
+latency, so the pipeline can be benchmarked without network or api keys.
+qdrant needs no fake: pass VectorStore a QdrantClient(":memory:")"""
+
+import hashlib
+import re
+import time
+from functools import lru_cache
+
+import numpy as np
+
+from rag.llm import GenerationSettings, build_messages
+
+TOKEN = re.compile(r"\w+")
+
+
+@lru_cache(maxsize=65536)
+def word_vector(word, dim):
+    seed = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dim, dtype=np.float32)
+
+
+def hashed_embedding(text, dim):
+    # sum of one pseudo-random vector per word, so texts sharing words are
+    # close and retrieval behaves roughly like a real embedder
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in TOKEN.findall(text.lower()):
+        vector += word_vector(word, dim)
+
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+class FakeEmbeddingService:
+    """EmbeddingService interface; each api call sleeps call_latency seconds"""
+
+    def __init__(self, dim=1024, call_latency=0.0, batch_size=96, concurrency=4):
+        self.dim = dim
+        self.call_latency = call_latency
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.dead_letters = []
+        self.zero_vector_fallbacks = 0
+        self.calls = 0
+
+    def _call(self, texts):
+        self.calls += 1
+        if self.call_latency:
+            time.sleep(self.call_latency)
+        return [hashed_embedding(text, self.dim) for text in texts]
+
+    def embed_texts(self, texts):
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.extend(self._call(texts[start : start + self.batch_size]))
+        return embeddings
+
+    def embed_queries(self, queries):
+        return self.embed_texts(queries)
+
+    def embed_query(self, query):
+        return self._call([query])[0]
+
+
+class FakeLLMService:
+    """LLMService interface; the first token after first_token_latency, then
+    one canned token every token_latency seconds"""
+
+    def __init__(self, first_token_latency=0.0, token_latency=0.0, tokens=32):
+        self.model = "fake"
+        self.settings = GenerationSettings()
+        self.first_token_latency = first_token_latency
+        self.token_latency = token_latency
+        self.tokens = tokens
+
+    def warm_up(self):
+        return None
+
+    def stream_generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
+        # built like the real call, so prompt assembly is part of the cost
+        build_messages(prompt, context, system_prompt)
+
+        start = time.perf_counter()
+        time.sleep(self.first_token_latency)
+        for i in range(min(self.tokens, max_tokens or self.tokens)):
+            if i and self.token_latency:
+                time.sleep(self.token_latency)
+            yield f"token{i} "
+
+        self.settings.record(time.perf_counter() - start, None)
+
+    def generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
+        return "".join(
+            self.stream_generate(prompt, context, system_prompt, max_tokens, num_ctx, stop)
+        )
+
+    def stats(self):
+        return self.settings.stats()
@@ -0,0 +1,93 @@
+"""recall@k and latency of the ivf index against exact search as the corpus grows"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from rag.ivf_index import IVFIndex
+
+
+def make_corpus(n, dim, clusters, rng):
+    # clustered unit vectors look more like real embeddings than uniform noise
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)]
+    vectors += 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def make_queries(corpus, count, rng):
+    queries = corpus[rng.integers(0, len(corpus), count)].copy()
+    queries += 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(corpus, query, k):
+    scores = corpus @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def percentiles(latencies):
+    ms = np.array(latencies) * 1000
+    return np.percentile(ms, 50), np.percentile(ms, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="5000,20000,50000")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nprobe", default="1,2,4,8,16,32")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    nprobes = [int(n) for n in args.nprobe.split(",")]
+
+    print(f"{'n':>7} {'mode':>12} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+    for n in [int(size) for size in args.sizes.split(",")]:
+        corpus = make_corpus(n, args.dim, clusters=max(8, n // 500), rng=rng)
+        queries = make_queries(corpus, args.queries, rng)
+
+        latencies = []
+        truth = []
+        for query in queries:
+            start = time.perf_counter()
+            truth.append(set(exact_top_k(corpus, query, args.top_k)))
+            latencies.append(time.perf_counter() - start)
+        p50, p99 = percentiles(latencies)
+        print(f"{n:>7} {'exact':>12} {1.0:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+        # train on the first half and add the rest incrementally, the way
+        # a growing collection is indexed
+        half = n // 2
+        index = IVFIndex()
+        index.train(corpus[:half])
+        index.add(corpus[:half])
+        index.add(corpus[half:])
+
+        for nprobe in nprobes:
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                rows, _ = index.search(query, corpus, args.top_k, nprobe=nprobe)
+                latencies.append(time.perf_counter() - start)
+                hits += len(expected & set(rows.tolist()))
+
+            recall = hits / (len(queries) * args.top_k)
+            p50, p99 = percentiles(latencies)
+            mode = f"ivf/{nprobe}"
+            print(f"{n:>7} {mode:>12} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+        print(f"{'':>7} nlist={len(index.centroids)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""chunk size / overlap / top_k sweep on the local vector backend: index cost
+(chunks, bytes, ingest time, search latency) against whether the expected
+source of each test question is retrieved (recall@k, mrr). no llm involved"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+
+# the real embedding cache, before the sweep's indexes are pointed elsewhere
+EMBEDDING_CACHE_DIR = Path(os.getenv("RAG_CACHE_DIR", ROOT_DIR / ".rag_cache")) / "embeddings"
+os.environ["RAG_CACHE_DIR"] = tempfile.mkdtemp(prefix="parameter_sweep_")
+
+sys.path.append(str(ROOT_DIR))
+sys.path.append(str(Path(__file__).parent))
+
+from fakes import FakeEmbeddingService
+
+from rag.document_loader import DocumentLoader
+from rag.local_vector_store import LocalVectorStore
+from rag.metrics import LatencyStats
+from test_questions_with_ground_truth import test_questions_with_ground_truth
+
+
+def make_embedder(name):
+    if name == "fake":
+        return FakeEmbeddingService()
+
+    # real cohere embeddings, but through the on-disk cache so each chunk
+    # text is only paid for once across configurations and runs
+    from rag.embedding_cache import EmbeddingCache
+    from rag.embeddings import EmbeddingService
+
+    embeddings = EmbeddingService()
+    embeddings.cache = EmbeddingCache(cache_dir=str(EMBEDDING_CACHE_DIR))
+    return embeddings
+
+
+def directory_bytes(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+def build_index(documents, embeddings, chunk_size, chunk_overlap):
+    start = time.perf_counter()
+    loader = DocumentLoader(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = loader.chunk_documents(documents)
+    loader.close()
+
+    texts = [chunk.page_content for chunk in chunks]
+    metadatas = [chunk.metadata for chunk in chunks]
+    vectors = embeddings.embed_texts(texts)
+
+    store = LocalVectorStore(collection_name=f"sweep_{chunk_size}_{chunk_overlap}")
+    store.create_collection(vector_size=len(vectors[0]))
+    store.add_documents(texts, vectors, metadatas)
+    return store, len(chunks), time.perf_counter() - start
+
+
+def evaluate(store, query_embeddings, expected, top_ks, rounds):
+    max_k = max(top_ks)
+    latency = LatencyStats(window=len(query_embeddings) * rounds)
+
+    ranks = []
+    for embedding, source in zip(query_embeddings, expected):
+        for _ in range(rounds):
+            start = time.perf_counter()
+            results = store.search(embedding, top_k=max_k)
+            latency.record(time.perf_counter() - start)
+
+        # 1-based rank of the first chunk from the expected source
+        sources = [result["metadata"].get("source") for result in results]
+        ranks.append(sources.index(source) + 1 if source in sources else None)
+
+    summary = latency.summary()
+    return {
+        "search_p50_ms": summary["p50"] * 1000,
+        "search_p95_ms": summary["p95"] * 1000,
+        "recall": {
+            k: sum(1 for rank in ranks if rank is not None and rank <= k) / len(ranks)
+            for k in top_ks
+        },
+        "mrr": sum(1 / rank for rank in ranks if rank is not None) / len(ranks),
+    }
+
+
+def cheapest(results, k, min_recall):
+    # smallest index that still finds the expected source often enough
+    passing = [result for result in results if result["recall"][k] >= min_recall]
+    return min(passing, key=lambda result: result["index_bytes"], default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--chunk-sizes", default="500,1000,1500,2000")
+    parser.add_argument("--overlaps", default="0,100,200")
+    parser.add_argument("--top-k", default="1,3,5,10")
+    parser.add_argument(
+        "--embedder",
+        choices=["fake", "cohere"],
+        default="fake",
+        help="fake hashes words offline; cohere uses the on-disk embedding cache",
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="timed searches per question")
+    parser.add_argument("--target-k", type=int, default=3, help="top_k the recall target applies to")
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    parser.add_argument("--output", default="parameter_sweep.json")
+    args = parser.parse_args()
+
+    chunk_sizes = [int(size) for size in args.chunk_sizes.split(",")]
+    overlaps = [int(overlap) for overlap in args.overlaps.split(",")]
+    top_ks = sorted({int(k) for k in args.top_k.split(",")} | {args.target_k})
+
+    embeddings = make_embedder(args.embedder)
+    documents = DocumentLoader().load_documents()
+
+    questions = [test_case["question"] for test_case in test_questions_with_ground_truth]
+    expected = [test_case["source"] for test_case in test_questions_with_ground_truth]
+    query_embeddings = embeddings.embed_queries(questions)
+    print(f"{len(documents)} files, {len(questions)} questions, {args.embedder} embedder")
+
+    recall_headers = " ".join(f"{f'r@{k}':>6}" for k in top_ks)
+    print(
+        f"{'size':>6} {'overlap':>7} {'chunks':>7} {'index KB':>9} {'ingest s':>8} "
+        f"{'p50 ms':>7} {'p95 ms':>7} {recall_headers} {'mrr':>6}"
+    )
+
+    results = []
+    for chunk_size in chunk_sizes:
+        for chunk_overlap in overlaps:
+            if chunk_overlap >= chunk_size:
+                continue
+
+            store, chunks, ingest_seconds = build_index(
+                documents, embeddings, chunk_size, chunk_overlap
+            )
+            result = {
+                "chunk_size": chunk_size,
+                "chunk_overlap": chunk_overlap,
+                "chunks": chunks,
+                "index_bytes": directory_bytes(store.store_dir),
+                "ingest_seconds": ingest_seconds,
+                **evaluate(store, query_embeddings, expected, top_ks, args.rounds),
+            }
+            results.append(result)
+
+            recalls = " ".join(f"{result['recall'][k]:>6.2f}" for k in top_ks)
+            print(
+                f"{chunk_size:>6} {chunk_overlap:>7} {chunks:>7} "
+                f"{result['index_bytes'] / 1024:>9.0f} {ingest_seconds:>8.2f} "
+                f"{result['search_p50_ms']:>7.2f} {result['search_p95_ms']:>7.2f} "
+                f"{recalls} {result['mrr']:>6.3f}"
+            )
+
+    best = cheapest(results, args.target_k, args.min_recall)
+    if best is None:
+        print(f"\nno configuration reaches recall@{args.target_k} >= {args.min_recall}")
+    else:
+        print(
+            f"\ncheapest with recall@{args.target_k} >= {args.min_recall}: "
+            f"CHUNK_SIZE={best['chunk_size']} CHUNK_OVERLAP={best['chunk_overlap']} "
+            f"({best['chunks']} chunks, {best['index_bytes'] / 1024:.0f} KB)"
+        )
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({"config": vars(args), "results": results}, f, indent=2)
+    print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""memory footprint, latency and recall@k of scalar and binary quantization
+against float vectors, for the local backend and for qdrant"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+# keep the benchmark's collections out of the real cache
+os.environ["RAG_CACHE_DIR"] = tempfile.mkdtemp(prefix="quantization_benchmark_")
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from ivf_benchmark import exact_top_k, make_corpus, make_queries, percentiles
+from qdrant_client import QdrantClient
+from qdrant_client.models import Distance, PointStruct, VectorParams
+
+from rag.local_vector_store import LocalVectorStore
+from rag.quantization import MODES, QuantizationSettings
+
+
+def footprint_mb(n, dim, mode):
+    # bytes that have to stay in ram for the first-pass scan
+    bytes_per_vector = {"none": dim * 4, "scalar": dim, "binary": dim // 8}[mode]
+    return n * bytes_per_vector / 1e6
+
+
+def measure(search, queries, truth, top_k):
+    latencies = []
+    hits = 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        found = search(query)
+        latencies.append(time.perf_counter() - start)
+        hits += len(expected & set(found))
+
+    p50, p99 = percentiles(latencies)
+    return hits / (len(queries) * top_k), p50, p99
+
+
+def bench_local(corpus, queries, truth, top_k, oversampling):
+    ids = [str(uuid.uuid4()) for _ in range(len(corpus))]
+    row_of = {point_id: row for row, point_id in enumerate(ids)}
+
+    for mode in MODES:
+        os.environ["QUANTIZATION"] = mode
+        store = LocalVectorStore(collection_name=f"bench_{mode}")
+        store.create_collection(vector_size=corpus.shape[1])
+        store.add_documents([""] * len(corpus), corpus, [{}] * len(corpus), ids=ids)
+        ram = footprint_mb(len(corpus), corpus.shape[1], mode)
+
+        for factor in oversampling if mode != "none" else [1.0]:
+            store.quantization.oversampling = factor
+            recall, p50, p99 = measure(
+                lambda query: [row_of[r["id"]] for r in store.search(query, top_k)],
+                queries,
+                truth,
+                top_k,
+            )
+            label = mode if mode == "none" else f"{mode}/{factor:g}"
+            print(f"{'local':>8} {label:>10} {ram:>8.1f} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+
+
+def bench_qdrant(client, corpus, queries, truth, top_k, modes):
+    for mode in modes:
+        os.environ["QUANTIZATION"] = mode
+        settings = QuantizationSettings()
+        name = f"quantization_benchmark_{mode}"
+
+        if client.collection_exists(name):
+            client.delete_collection(name)
+        client.create_collection(
+            collection_name=name,
+            vectors_config=VectorParams(
+                size=corpus.shape[1], distance=Distance.COSINE, on_disk=settings.enabled
+            ),
+            quantization_config=settings.qdrant_config(),
+        )
+        for start in range(0, len(corpus), 256):
+            client.upsert(
+                collection_name=name,
+                points=[
+                    PointStruct(id=row, vector=corpus[row].tolist())
+                    for row in range(start, min(start + 256, len(corpus)))
+                ],
+            )
+
+        search_params = settings.qdrant_search_params()
+        recall, p50, p99 = measure(
+            lambda query: [
+                hit.id
+                for hit in client.query_points(
+                    collection_name=name,
+                    query=query.tolist(),
+                    limit=top_k,
+                    search_params=search_params,
+                ).points
+            ],
+            queries,
+            truth,
+            top_k,
+        )
+        ram = footprint_mb(len(corpus), corpus.shape[1], mode)
+        label = mode if mode == "none" else f"{mode}/{settings.oversampling:g}"
+        print(f"{'qdrant':>8} {label:>10} {ram:>8.1f} {recall:>9.3f} {p50:>8.3f} {p99:>8.3f}")
+        client.delete_collection(name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--n", type=int, default=50000)
+    parser.add_argument("--qdrant-n", type=int, default=5000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--oversampling", default="1,2,3,10", help="local backend sweep")
+    parser.add_argument(
+        "--qdrant-url",
+        default=os.getenv("QDRANT_BENCHMARK_URL", ":memory:"),
+        help="qdrant server url, or :memory: for the in-process local mode",
+    )
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    print(f"{'backend':>8} {'mode':>10} {'ram MB':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+    corpus = make_corpus(args.n, args.dim, clusters=max(8, args.n // 500), rng=rng)
+    queries = make_queries(corpus, args.queries, rng)
+    truth = [set(exact_top_k(corpus, query, args.top_k).tolist()) for query in queries]
+    oversampling = [float(factor) for factor in args.oversampling.split(",")]
+    bench_local(corpus, queries, truth, args.top_k, oversampling)
+
+    # qdrant's local mode is pure python, so it gets a smaller corpus
+    corpus = corpus[: args.qdrant_n]
+    truth = [set(exact_top_k(corpus, query, args.top_k).tolist()) for query in queries]
+    if args.qdrant_url == ":memory:":
+        # the in-process mode accepts quantization settings but searches the
+        # full-precision vectors, so its "quantized" rows would repeat these
+        client = QdrantClient(location=":memory:")
+        bench_qdrant(client, corpus, queries, truth, args.top_k, ["none"])
+        print("note: qdrant's in-process mode doesn't apply quantization, so only its")
+        print("      float baseline is shown; pass --qdrant-url for quantized results")
+    else:
+        client = QdrantClient(url=args.qdrant_url, api_key=os.getenv("QDRANT_API_KEY"))
+        bench_qdrant(client, corpus, queries, truth, args.top_k, MODES)
+
+
+if __name__ == "__main__":
+    main()
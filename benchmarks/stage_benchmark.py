@@ -0,0 +1,203 @@
+"""p50/p95/p99 per query stage and ingest chunks/sec, against local fakes for
+cohere and ollama and qdrant's in-memory mode, so it needs no network or keys"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# fakes and a throwaway cache, set before the rag modules read them
+os.environ["RAG_CACHE_DIR"] = tempfile.mkdtemp(prefix="stage_benchmark_")
+os.environ["EMBEDDING_CACHE"] = "0"
+os.environ["RETRIEVAL_MODE"] = "vector"
+os.environ["LEAN_PAYLOAD"] = "0"
+os.environ["QUANTIZATION"] = "none"
+# every end_to_end query pays for generation, not an answer cache hit
+os.environ["ANSWER_CACHE_SIZE"] = "0"
+
+sys.path.append(str(Path(__file__).parent.parent))
+sys.path.append(str(Path(__file__).parent))
+
+from fakes import FakeEmbeddingService, FakeLLMService
+from qdrant_client import QdrantClient
+
+from rag.document_loader import DocumentLoader
+from rag.ingest_pipeline import IngestPipeline
+from rag.manifest import DeadLetters, IngestManifest
+from rag.metrics import LatencyStats
+from rag.rag_chain import RAGChain
+from rag.retriever import Retriever
+from rag.vector_store import VectorStore
+from test_questions_with_ground_truth import test_questions_with_ground_truth
+
+STAGES = ("embed", "search", "context", "first_token", "generation", "end_to_end")
+
+
+def bench_ingest(embeddings, store):
+    pipeline = IngestPipeline(
+        loader=DocumentLoader(),
+        embeddings=embeddings,
+        vector_store=store,
+        manifest=IngestManifest(),
+        dead_letters=DeadLetters(),
+        bm25=None,
+        full=True,
+    )
+
+    start = time.perf_counter()
+    report = pipeline.run()
+    elapsed = time.perf_counter() - start
+
+    chunks = report["stages"]["upsert"]["items"]
+    return {
+        "documents": report["documents"],
+        "chunks": chunks,
+        "seconds": elapsed,
+        "chunks_per_second": chunks / elapsed if elapsed > 0 else 0.0,
+        "stages": report["stages"],
+    }
+
+
+def bench_query(chain, questions, rounds, top_k):
+    stats = {stage: LatencyStats(window=len(questions) * rounds) for stage in STAGES}
+    retriever = chain.retriever
+
+    def timed(stage, fn, *args):
+        start = time.perf_counter()
+        result = fn(*args)
+        stats[stage].record(time.perf_counter() - start)
+        return result
+
+    for _ in range(rounds):
+        for question in questions:
+            # every round pays the full cost, not a cache hit
+            retriever.query_cache.clear()
+            retriever.results_cache.clear()
+
+            embedding = timed("embed", retriever.embed_query, question)
+            results = timed("search", retriever.vector_store.search, embedding, top_k)
+            context = timed("context", chain.build_context, results)
+
+            start = time.perf_counter()
+            tokens = chain.llm.stream_generate(
+                prompt=question, context=context, system_prompt=chain.system_prompt
+            )
+            next(tokens, None)
+            stats["first_token"].record(time.perf_counter() - start)
+            for _ in tokens:
+                pass
+            stats["generation"].record(time.perf_counter() - start)
+
+            retriever.query_cache.clear()
+            retriever.results_cache.clear()
+            timed("end_to_end", chain.query, question, top_k)
+
+    return {stage: in_ms(values.summary()) for stage, values in stats.items()}
+
+
+def in_ms(summary):
+    return {
+        key: value * 1000 if key != "count" else value for key, value in summary.items()
+    }
+
+
+# flags that only control the comparison, not what is measured
+COMPARISON_FLAGS = ("output", "tolerance", "slack_ms")
+
+
+def compare(results, baseline_path, tolerance, slack_ms=0.0):
+    # stages whose p95 got slower than the baseline allows; slack_ms keeps
+    # sub-millisecond stages from failing on scheduler noise
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    # numbers measured with other fake latencies or rounds don't compare
+    for key, value in results["config"].items():
+        before = baseline.get("config", {}).get(key)
+        if key not in COMPARISON_FLAGS and before != value:
+            regressions.append(f"config {key}={value!r}, baseline has {before!r}")
+    if regressions:
+        return regressions
+
+    for stage, summary in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95")
+        if before and summary.get("p95", 0) > before * tolerance + slack_ms:
+            regressions.append(f"{stage} p95 {summary['p95']:.2f}ms vs {before:.2f}ms")
+
+    before = baseline.get("ingest", {}).get("chunks_per_second")
+    after = results["ingest"]["chunks_per_second"]
+    if before and after < before / tolerance:
+        regressions.append(f"ingest {after:.0f} chunks/s vs {before:.0f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5, help="passes over the test questions")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="fake cohere call latency")
+    parser.add_argument("--first-token-ms", type=float, default=0.0, help="fake ollama ttft")
+    parser.add_argument("--token-ms", type=float, default=0.0, help="fake ollama per-token latency")
+    parser.add_argument("--tokens", type=int, default=32, help="tokens per fake answer")
+    parser.add_argument("--output", default="stage_benchmark.json")
+    parser.add_argument("--baseline", help="earlier --output to compare p95s against")
+    parser.add_argument(
+        "--tolerance", type=float, default=1.5, help="allowed slowdown factor vs the baseline"
+    )
+    parser.add_argument(
+        "--slack-ms", type=float, default=0.0, help="extra p95 milliseconds allowed per stage"
+    )
+    args = parser.parse_args()
+
+    embeddings = FakeEmbeddingService(dim=args.dim, call_latency=args.embed_ms / 1000)
+    llm = FakeLLMService(
+        first_token_latency=args.first_token_ms / 1000,
+        token_latency=args.token_ms / 1000,
+        tokens=args.tokens,
+    )
+    store = VectorStore(
+        client=QdrantClient(location=":memory:"), collection_name="stage_benchmark", in_process=True
+    )
+    store.create_collection(vector_size=args.dim)
+
+    ingest = bench_ingest(embeddings, store)
+    print(
+        f"ingest: {ingest['chunks']} chunks from {ingest['documents']} files in "
+        f"{ingest['seconds']:.2f}s ({ingest['chunks_per_second']:.0f} chunks/s)"
+    )
+
+    chain = RAGChain(retriever=Retriever(embeddings=embeddings, vector_store=store), llm=llm)
+    questions = [test_case["question"] for test_case in test_questions_with_ground_truth]
+    stages = bench_query(chain, questions, args.rounds, args.top_k)
+
+    print(f"{'stage':>12} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for stage, summary in stages.items():
+        print(
+            f"{stage:>12} {summary['count']:>6} {summary['p50']:>8.2f} "
+            f"{summary['p95']:>8.2f} {summary['p99']:>8.2f}"
+        )
+
+    results = {
+        "config": {key: value for key, value in vars(args).items() if key != "baseline"},
+        "stages": stages,
+        "ingest": ingest,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance, args.slack_ms)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
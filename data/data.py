@@ -3,19 +3,25 @@ collects various data sources from github to use with markdown files for RAG
 """
 
 import os
+import sys
+import json
 import base64
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 
-load_dotenv()
+sys.path.append(str(Path(__file__).parent.parent))
+
+from rag.rate_limit import TokenBucket
 
 # configuration
 OUTPUT_DIR = "."
-DELAY = 0.1
-REPO_DELAY = 5
-GITHUB_TOKEN = os.environ.get("GITHUB_TOKEN", "")
+MANIFEST_FILE = "manifest.json"
+MAX_DEPTH = 3
 
 SOURCES = {
     "manual": {"repo": "opengovfoundation/hr-manual", "paths": ["markdown/"]},
@@ -24,122 +30,226 @@ SOURCES = {
 }
 
 
-def get_repo_contents(repo, path=""):
-    """get contents of a repository directory"""
-    url = f"https://api.github.com/repos/{repo}/contents/{path}"
+class GitHubClient:
+    """one pooled session and one rate limit shared by every request.
+    settings left as None are read from the environment when the client is
+    built, so importing this module reads nothing"""
+
+    def __init__(
+        self,
+        api_url=None,
+        token=None,
+        workers=None,
+        rate=None,
+        max_retries=3,
+        session=None,
+    ):
+        # point GITHUB_API_URL at a local stand-in to test without github
+        api_url = api_url or os.environ.get("GITHUB_API_URL", "https://api.github.com")
+        token = token if token is not None else os.environ.get("GITHUB_TOKEN", "")
+        self.workers = workers or int(os.environ.get("GITHUB_WORKERS", "8"))
+        rate = rate or float(os.environ.get("GITHUB_RATE_LIMIT", "10"))
+
+        self.api_url = api_url.rstrip("/")
+        self.max_retries = max_retries
+        self.rate_limiter = TokenBucket(rate=rate)
+
+        if session is None:
+            session = requests.Session()
+            # enough kept-alive connections for every download worker
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, self.workers))
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+        self.session.headers["Accept"] = "application/vnd.github+json"
+        if token:
+            self.session.headers["Authorization"] = f"token {token}"
+
+    def get(self, path, headers=None):
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            response = self.session.get(f"{self.api_url}{path}", headers=headers, timeout=30)
+
+            throttled = response.status_code == 429 or (
+                response.status_code == 403
+                and response.headers.get("X-RateLimit-Remaining") == "0"
+            )
+            if throttled:
+                self.rate_limiter.on_throttle()
+            elif response.status_code < 500:
+                self.rate_limiter.on_success()
+                return response
+
+            if attempt < self.max_retries:
+                time.sleep(min(30.0, 2**attempt) * (0.5 + random.random()))
+
+        return response
+
+
+def is_collected(path, prefixes):
+    """markdown under one of the source paths, at most MAX_DEPTH levels down"""
+    if not path.endswith((".md", ".markdown")):
+        return False
+
+    for prefix in prefixes:
+        if path.startswith(prefix) and path[len(prefix) :].count("/") < MAX_DEPTH:
+            return True
+    return False
 
-    headers = {}
-    if GITHUB_TOKEN:
-        headers["Authorization"] = f"token {GITHUB_TOKEN}"
 
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
+def list_markdown_files(client, repo, prefixes, etag=None):
+    """{path: blob sha} from one recursive tree listing, and the listing's
+    etag. None instead of files when the tree is unchanged or unreadable"""
+    headers = {"If-None-Match": etag} if etag else None
+    response = client.get(f"/repos/{repo}/git/trees/HEAD?recursive=1", headers=headers)
+
+    # not modified, and not counted against the rate limit
+    if response.status_code == 304:
+        return None, etag
+
+    if response.status_code != 200:
+        print(f"error: listing {repo} failed ({response.status_code}), keeping previous files")
+        return None, None
+
+    tree = response.json()
+    if tree.get("truncated"):
+        print(f"warning: tree of {repo} is truncated, some files may be missing")
+
+    files = {
+        item["path"]: item["sha"]
+        for item in tree["tree"]
+        if item["type"] == "blob" and is_collected(item["path"], prefixes)
+    }
+    return files, response.headers.get("ETag")
+
+
+def download_blob(client, repo, sha):
+    """file content by blob sha; blobs never change, so no conditional needed"""
+    response = client.get(f"/repos/{repo}/git/blobs/{sha}")
+    if response.status_code != 200:
+        raise RuntimeError(f"blob {sha} returned {response.status_code}")
+
+    blob = response.json()
+    return base64.b64decode(blob["content"]).decode("utf-8")
+
+
+def collect_source(client, executor, source_name, config, previous):
+    """sync one source directory with its repo, returning its manifest entry
+    and what changed"""
+    repo = config["repo"]
+    source_dir = os.path.join(OUTPUT_DIR, source_name)
+    os.makedirs(source_dir, exist_ok=True)
+
+    known = previous.get("files", {})
+    files, etag = list_markdown_files(client, repo, config["paths"], previous.get("etag"))
+    if files is None:
+        files = {entry["path"]: entry["sha"] for entry in known.values()}
+
+    changes = {"added": [], "modified": [], "removed": [], "unchanged": 0, "failed": []}
+    entries = {}
+    downloads = []
+
+    for path, sha in files.items():
+        local_filename = path.replace("/", "_")
+        local_path = os.path.join(source_dir, local_filename)
+        entries[local_filename] = {"path": path, "sha": sha}
+
+        before = known.get(local_filename)
+        if before is not None and before["sha"] == sha and os.path.exists(local_path):
+            changes["unchanged"] += 1
+            continue
+
+        kind = "added" if before is None or not os.path.exists(local_path) else "modified"
+        downloads.append((local_filename, local_path, path, sha, kind))
+
+    def fetch(download):
+        local_filename, local_path, path, sha, kind = download
+        try:
+            content = download_blob(client, repo, sha)
+        except Exception as e:
+            print(f"failed: {path}: {e}")
+            return local_filename, kind, False
+
+        with open(local_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        print(f"downloaded: {path}")
+        return local_filename, kind, True
+
+    for local_filename, kind, ok in executor.map(fetch, downloads):
+        if ok:
+            changes[kind].append(os.path.join(source_name, local_filename))
         else:
-            print("most likely rate limited")
-            return []
-    except Exception as e:
-        print(f"error: {e}")
-        return []
-
-
-def download_file(repo, file_path, local_path):
-    """download a single file from github"""
-    url = f"https://api.github.com/repos/{repo}/contents/{file_path}"
-
-    headers = {}
-    if GITHUB_TOKEN:
-        headers["Authorization"] = f"token {GITHUB_TOKEN}"
-
-    try:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            file_info = response.json()
-
-            if file_info.get("type") == "file" and file_info.get("content"):
-                # decode content
-                content = base64.b64decode(file_info["content"]).decode("utf-8")
-
-                # create directory
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-
-                # save file
-                with open(local_path, "w", encoding="utf-8") as f:
-                    f.write(content)
-
-                print(f"downloaded: {file_path}")
-                return True
-    except Exception as e:
-        print(f"failed: {file_path}")
-
-    return False
+            # left out of the manifest, so the next run tries again
+            changes["failed"].append(os.path.join(source_name, local_filename))
+            entries.pop(local_filename)
 
+    for local_filename in known.keys() - {path.replace("/", "_") for path in files}:
+        local_path = os.path.join(source_dir, local_filename)
+        if os.path.exists(local_path):
+            os.remove(local_path)
+        changes["removed"].append(os.path.join(source_name, local_filename))
 
-def find_markdown_files(repo, path="", max_depth=3):
-    """find all markdown files in a repository path"""
-    if max_depth <= 0:
-        return []
+    # a failed download must not be hidden behind a 304 next time
+    if changes["failed"]:
+        etag = None
 
-    markdown_files = []
-    contents = get_repo_contents(repo, path)
+    return {"repo": repo, "etag": etag, "files": entries}, changes
 
-    print(f"found {len(contents)} items in {repo}/{path}")
 
-    time.sleep(DELAY)
+def load_manifest():
+    try:
+        with open(MANIFEST_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"sources": {}}
 
-    for item in contents:
-        if item["type"] == "file":
-            if item["name"].endswith((".md", ".markdown")):
-                markdown_files.append(item["path"])
-        elif item["type"] == "dir":
-            # search subdirectories
-            sub_files = find_markdown_files(repo, item["path"], max_depth - 1)
-            markdown_files.extend(sub_files)
 
-    return markdown_files
+def save_manifest(manifest):
+    tmp_path = f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, MANIFEST_FILE)
 
 
 def main():
+    load_dotenv()
     print("collecting markdown files... ")
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-    total_files = 0
-
-    for i, (source_name, config) in enumerate(SOURCES.items()):
-        if i > 0:
-            print(f"waiting {REPO_DELAY}s...")
-            time.sleep(REPO_DELAY)
-
-        print(f"processing {source_name}")
-
-        source_dir = os.path.join(OUTPUT_DIR, source_name)
-        os.makedirs(source_dir, exist_ok=True)
-
-        repo = config["repo"]
-        files_collected = 0
-
-        for path in config["paths"]:
-            print(f"searching {repo}/{path}")
-
-            markdown_files = find_markdown_files(repo, path)
-            print(f"found {len(markdown_files)} files")
-
-            for file_path in markdown_files:
-                # create local filename
-                local_filename = file_path.replace("/", "_")
-                local_path = os.path.join(source_dir, local_filename)
-
-                if download_file(repo, file_path, local_path):
-                    files_collected += 1
-
-                time.sleep(DELAY)
-
-        total_files += files_collected
-        print(f"collected {files_collected} files")
-
-    print(f"\ndone! {total_files} files saved to {OUTPUT_DIR}/")
+    client = GitHubClient()
+    manifest = load_manifest()
+    sources = {}
+    # files written or deleted by this run, relative to the data directory
+    changes = {"added": [], "modified": [], "removed": [], "failed": []}
+
+    with ThreadPoolExecutor(max_workers=max(1, client.workers)) as executor:
+        for source_name, config in SOURCES.items():
+            print(f"processing {source_name}")
+
+            previous = manifest["sources"].get(source_name, {})
+            if previous.get("repo") != config["repo"]:
+                previous = {}
+
+            sources[source_name], source_changes = collect_source(
+                client, executor, source_name, config, previous
+            )
+            for kind in changes:
+                changes[kind].extend(source_changes[kind])
+
+            print(
+                f"{source_name}: {len(source_changes['added'])} added, "
+                f"{len(source_changes['modified'])} modified, "
+                f"{len(source_changes['removed'])} removed, "
+                f"{source_changes['unchanged']} unchanged"
+            )
+
+    save_manifest({"sources": sources, "changes": changes, "collected_at": time.time()})
+
+    total_files = sum(len(source["files"]) for source in sources.values())
+    print(f"\ndone! {total_files} files in {OUTPUT_DIR}/, changes in {MANIFEST_FILE}")
+    if changes["failed"]:
+        print(f"{len(changes['failed'])} downloads failed, they will be retried next run")
 
 
 if __name__ == "__main__":
@@ -1,5 +1,10 @@
+import argparse
+import hashlib
+import itertools
+import json
 import sys
 import os
+import threading
 from pathlib import Path
 from datetime import datetime
 
@@ -17,42 +22,143 @@ from ragas.metrics import (
     context_recall,
     context_precision,
 )
-from rag.rag_chain import RAGChain
+from rag.paths import cache_path
+from rag.rag_chain import ANSWER_SETTINGS, SYSTEM_PROMPT, RAGChain
+from rag.retriever import Retriever
+from rag.vector_store import create_vector_store
 from test_questions_with_ground_truth import test_questions_with_ground_truth
 
+# settings that change what the pipeline answers; any change starts a new
+# checkpoint, as it invalidates the answer cache
+FINGERPRINT_SETTINGS = ANSWER_SETTINGS
 
-def prepare_ragas_dataset():
-    rag = RAGChain()
+
+def pipeline_fingerprint(vector_store, top_k):
+    # the active store's version stamp (one per shard under SHARD_BY_SOURCE)
+    # changes on every ingest, so re-ingesting invalidates the cached answers too
+    config = {
+        "settings": {name: os.getenv(name, "") for name in FINGERPRINT_SETTINGS},
+        "index_version": vector_store.version(),
+        "system_prompt": SYSTEM_PROMPT,
+        "top_k": top_k,
+    }
+    encoded = json.dumps(config, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+class Checkpoint:
+    """(question, answer, contexts) records as jsonl, appended as each answer
+    finishes so a crash keeps everything generated so far"""
+
+    def __init__(self, fingerprint):
+        self.path = cache_path("eval") / f"{fingerprint}.jsonl"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def load(self):
+        records = {}
+        if not self.path.exists():
+            return records
+
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # a line cut short by a crash
+                    continue
+                records[record["question"]] = record
+        return records
+
+    def append(self, record):
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+def generate_answers(test_cases, checkpoint, vector_store, top_k, concurrency):
+    """answers for test cases the checkpoint doesn't have yet"""
+    rag = RAGChain(retriever=Retriever(vector_store=vector_store))
+    questions = [test_case["question"] for test_case in test_cases]
+    # next() on a count is atomic, the workers share it
+    done = itertools.count(1)
+
+    def on_result(i, result):
+        finished = next(done)
+        if result.get("error"):
+            # not checkpointed, so the next run retries it
+            print(f"error: {questions[i]}: {result['error']}")
+            return
+
+        checkpoint.append(
+            {
+                "question": questions[i],
+                "answer": result["answer"],
+                "contexts": [source["text"] for source in result["sources"]],
+            }
+        )
+        print(f"answered {finished}/{len(questions)}")
+
+    # one embedding call and one batch search, then bounded concurrent generation
+    rag.query_batch(questions, top_k=top_k, max_concurrency=concurrency, on_result=on_result)
+
+
+def prepare_ragas_dataset(top_k=3, concurrency=None, rescore=False, fresh=False):
+    # the store that answers the questions is the one fingerprinted
+    vector_store = create_vector_store()
+    fingerprint = pipeline_fingerprint(vector_store, top_k)
+    checkpoint = Checkpoint(fingerprint)
+    if fresh:
+        checkpoint.clear()
+
+    records = checkpoint.load()
+    missing = [
+        test_case
+        for test_case in test_questions_with_ground_truth
+        if test_case["question"] not in records
+    ]
+    print(
+        f"checkpoint {fingerprint}: {len(records)} answers cached, "
+        f"{len(missing)} to generate"
+    )
+
+    if missing and not rescore:
+        print("generating answers for evaluation...")
+        generate_answers(missing, checkpoint, vector_store, top_k, concurrency)
+        records = checkpoint.load()
 
     questions = []
     answers = []
     contexts = []
     ground_truths = []
 
-    print("generating answers for evaluation...")
-
-    for i, test_case in enumerate(test_questions_with_ground_truth):
-        print(
-            f"processing {i+1}/{len(test_questions_with_ground_truth)}: {test_case['question'][:50]}..."
-        )
-
-        try:
-            result = rag.query(test_case["question"])
+    for test_case in test_questions_with_ground_truth:
+        record = records.get(test_case["question"])
+        if record is None:
+            if rescore:
+                # --rescore only scores what was already generated
+                continue
 
-            # extract context from sources
-            context_list = [source["text"] for source in result["sources"]]
-
-            questions.append(test_case["question"])
-            answers.append(result["answer"])
-            contexts.append(context_list)
-            ground_truths.append(test_case["ground_truth"])
-
-        except Exception as e:
-            print(f"error: {e}")
             questions.append(test_case["question"])
             answers.append("Error generating answer")
             contexts.append(["No context retrieved"])
             ground_truths.append("Error")
+            continue
+
+        # ground truth comes from the question file, so it can be edited
+        # without regenerating
+        questions.append(test_case["question"])
+        answers.append(record["answer"])
+        contexts.append(record["contexts"])
+        ground_truths.append(test_case["ground_truth"])
+
+    if not questions:
+        raise RuntimeError(
+            f"no cached answers for checkpoint {fingerprint}, run without --rescore first"
+        )
 
     # create dataset dictionary
     data = {
@@ -65,9 +171,9 @@ def prepare_ragas_dataset():
     return Dataset.from_dict(data)
 
 
-def run_ragas_evaluation():
+def run_ragas_evaluation(top_k=3, concurrency=None, rescore=False, fresh=False):
     print("preparing dataset...")
-    dataset = prepare_ragas_dataset()
+    dataset = prepare_ragas_dataset(top_k, concurrency, rescore, fresh)
 
     print("\nrunning ragas evaluation (using openai to judge quality)...")
 
@@ -122,11 +228,29 @@ def save_results(result):
 
 
 def main():
+    parser = argparse.ArgumentParser(description="ragas evaluation of the rag pipeline")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=None,
+        help="concurrent generations (default LLM_CONCURRENCY)",
+    )
+    parser.add_argument(
+        "--rescore",
+        action="store_true",
+        help="score the cached answers only, without generating missing ones",
+    )
+    parser.add_argument(
+        "--fresh", action="store_true", help="discard the cached answers for this config"
+    )
+    args = parser.parse_args()
+
     print("ragas rag evaluation")
     print("=" * 50)
 
     try:
-        result = run_ragas_evaluation()
+        result = run_ragas_evaluation(args.top_k, args.concurrency, args.rescore, args.fresh)
         save_results(result)
     except Exception as e:
         print(f"\nerror: {e}")
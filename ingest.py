@@ -1,44 +1,87 @@
+import argparse
+import os
 import sys
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent))
 
+from rag.bm25 import BM25Index, discard_bm25_index
 from rag.document_loader import DocumentLoader
 from rag.embeddings import EmbeddingService
-from rag.vector_store import VectorStore
+from rag.ingest_pipeline import IngestPipeline
+from rag.manifest import DeadLetters, IngestManifest
+from rag.vector_store import create_vector_store
 
 
 def main():
+    parser = argparse.ArgumentParser(description="ingest markdown into the vector store")
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="re-embed every file instead of only new or changed ones",
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        help="only ingest this source (repeatable); with --full and SHARD_BY_SOURCE=1 "
+        "its shard is rebuilt from scratch",
+    )
+    args = parser.parse_args()
+
     print("starting ingestion...")
 
-    # load and chunk documents
+    # initialize services
     loader = DocumentLoader()
-    documents = loader.load_documents()
-    chunks = loader.chunk_documents(documents)
-    print(f"loaded {len(documents)} docs, created {len(chunks)} chunks")
+    if args.source:
+        unknown = set(args.source) - set(loader.sources)
+        if unknown:
+            parser.error(f"unknown source(s) {sorted(unknown)}, expected {loader.sources}")
+        loader.sources = args.source
 
-    # initialize services
     embeddings_service = EmbeddingService()
-    vector_store = VectorStore()
+    vector_store = create_vector_store()
+    vector_store.create_collection()
 
-    # recreate collection
-    # try:
-    #     vector_store.delete_collection()
-    # except:
-    #     pass
+    # a full rebuild of a source only empties that source's shard
+    if args.source and args.full and hasattr(vector_store, "rebuild_shard"):
+        for source in args.source:
+            print(f"rebuilding shard '{source}'")
+            vector_store.rebuild_shard(source)
 
-    # vector_store.create_collection()
+    # the lexical index holds every chunk's text, so it's only kept when used
+    bm25 = None
+    if os.getenv("RETRIEVAL_MODE", "vector") == "hybrid":
+        bm25 = BM25Index()
+    elif discard_bm25_index():
+        print("dropped the bm25 index, the next ingest with RETRIEVAL_MODE=hybrid rebuilds it")
 
-    # prepare data for embedding
-    texts = [chunk.page_content for chunk in chunks]
-    metadatas = [chunk.metadata for chunk in chunks]
+    # load -> chunk -> embed -> upsert run concurrently, compared against the last run
+    pipeline = IngestPipeline(
+        loader=loader,
+        embeddings=embeddings_service,
+        vector_store=vector_store,
+        manifest=IngestManifest(settings=loader.settings()),
+        dead_letters=DeadLetters(),
+        bm25=bm25,
+        full=args.full,
+        sources=args.source,
+    )
+    report = pipeline.run()
 
-    print("generating embeddings...")
-    embeddings = embeddings_service.embed_texts(texts)
+    print(
+        f"loaded {report['documents']} docs: {report['changed']} new or changed, "
+        f"{report['removed']} removed, {report['stale']} stale points deleted"
+    )
+    for name, stage in report["stages"].items():
+        print(
+            f"  {name}: {stage['items']} items in {stage['seconds']:.1f}s "
+            f"({stage['items_per_second']:.0f}/s, busy {stage['busy_seconds']:.1f}s)"
+        )
+    if report["bm25_chunks"] is not None:
+        print(f"bm25 index: {report['bm25_chunks']} chunks")
 
-    # upload to vector store
-    print("uploading...")
-    vector_store.add_documents(texts, embeddings, metadatas)
+    if report["failed"]:
+        print(f"{report['failed']} chunks failed to embed, they will be retried next run")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import atexit
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .paths import cache_path
+
+load_dotenv()
+
+
+class AnswerCache:
+    """bounded lru cache of generated answers, looked up by cosine similarity
+    of the question embedding. only questions asked with the same
+    source_filter and top_k can match, and every entry is dropped once the
+    version it was answered under (index, model, prompt, settings) changes.
+    off unless ANSWER_CACHE_SIZE is set"""
+
+    def __init__(self, cache_dir=None, max_entries=None, threshold=None):
+        self.cache_dir = cache_dir or cache_path("answers")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.npy")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.max_entries = (
+            max_entries if max_entries is not None else int(os.getenv("ANSWER_CACHE_SIZE", "0"))
+        )
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        )
+        self.save_every = int(os.getenv("ANSWER_CACHE_SAVE_EVERY", "16"))
+
+        self.hits = 0
+        self.misses = 0
+        self.unsaved = 0
+        self.version = None
+
+        self._entries = OrderedDict()  # id -> entry, least recently used first
+        self._next_id = 0
+        # per (source_filter, top_k): entry ids and their stacked unit vectors
+        self._matrices = {}
+        self._lock = threading.Lock()
+        # one save at a time; the disk writes happen outside _lock
+        self._save_lock = threading.Lock()
+
+        self._load()
+        atexit.register(self.save)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            vectors = np.load(self.vectors_path)
+        except (OSError, ValueError):
+            return
+
+        # a crash between the two writes leaves them out of step
+        if len(vectors) != len(index["entries"]):
+            return
+
+        self.version = index["version"]
+        for entry, vector in zip(index["entries"], vectors):
+            entry["vector"] = vector
+            self._entries[self._next_id] = entry
+            self._next_id += 1
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        # a zero vector means the embedding call failed
+        return vector / norm if norm > 0 else None
+
+    def _check_version(self, version):
+        # called with the lock held
+        if version != self.version:
+            self._entries.clear()
+            self._matrices.clear()
+            self.version = version
+            self.unsaved += 1
+
+    def _matrix(self, scope):
+        if scope not in self._matrices:
+            ids = [
+                entry_id
+                for entry_id, entry in self._entries.items()
+                if (entry["source_filter"], entry["top_k"]) == scope
+            ]
+            vectors = None
+            if ids:
+                vectors = np.stack([self._entries[entry_id]["vector"] for entry_id in ids])
+            self._matrices[scope] = (ids, vectors)
+        return self._matrices[scope]
+
+    def get(self, embedding, source_filter, top_k, version):
+        """the closest cached answer at or above the threshold, as
+        {"answer", "sources", "question", "similarity"}, or None"""
+        if not self.enabled:
+            return None
+
+        vector = self._unit(embedding)
+        with self._lock:
+            self._check_version(version)
+            if vector is None:
+                self.misses += 1
+                return None
+
+            ids, vectors = self._matrix((source_filter, top_k))
+            if vectors is None:
+                self.misses += 1
+                return None
+
+            similarities = vectors @ vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry = self._entries[ids[best]]
+            self._entries.move_to_end(ids[best])
+            self.hits += 1
+            return {
+                "answer": entry["answer"],
+                # callers may edit the source dicts; the cached ones stay intact
+                "sources": copy.deepcopy(entry["sources"]),
+                "question": entry["question"],
+                "similarity": float(similarities[best]),
+            }
+
+    def put(self, embedding, question, source_filter, top_k, version, answer, sources):
+        vector = self._unit(embedding)
+        if not self.enabled or vector is None or not answer:
+            return
+
+        with self._lock:
+            # answered under a version that has changed since the lookup
+            if version != self.version:
+                return
+
+            self._entries[self._next_id] = {
+                "question": question,
+                "source_filter": source_filter,
+                "top_k": top_k,
+                "answer": answer,
+                "sources": sources,
+                "vector": vector,
+            }
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            # rebuilt lazily on the next lookup of each scope
+            self._matrices.clear()
+            self.unsaved += 1
+
+        if self.unsaved >= self.save_every:
+            self.save()
+
+    def save(self):
+        with self._save_lock:
+            # entries are never changed once added, so a snapshot of the list
+            # can be written while lookups and puts carry on
+            with self._lock:
+                if not self.unsaved:
+                    return
+                entries = list(self._entries.values())
+                version = self.version
+                self.unsaved = 0
+
+            vectors = (
+                np.stack([entry["vector"] for entry in entries])
+                if entries
+                else np.zeros((0, 0), dtype=np.float32)
+            )
+
+            # vectors first; the index is what makes them count
+            tmp_vectors = f"{self.vectors_path}.tmp.npy"
+            np.save(tmp_vectors, vectors)
+            os.replace(tmp_vectors, self.vectors_path)
+
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "version": version,
+                        "entries": [
+                            {k: v for k, v in entry.items() if k != "vector"}
+                            for entry in entries
+                        ],
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.index_path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,221 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from dotenv import load_dotenv
+import numpy as np
+
+from .paths import cache_path
+
+load_dotenv()
+
+# keeps command names and config keys like sshkit or env_file intact
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def bm25_index_dir(collection_name=None):
+    return cache_path(f"bm25/{collection_name or os.getenv('COLLECTION_NAME', 'tako_docs')}")
+
+
+def discard_bm25_index(collection_name=None):
+    """drop an index that a vector-only ingest can't keep in step with the
+    collection; the next hybrid ingest rebuilds it. True if there was one"""
+    index_dir = bm25_index_dir(collection_name)
+    postings_path = os.path.join(index_dir, "postings.npz")
+    if not os.path.exists(postings_path):
+        return False
+
+    # postings first: without them the index loads as empty
+    os.remove(postings_path)
+    docs_path = os.path.join(index_dir, "docs.json")
+    if os.path.exists(docs_path):
+        os.remove(docs_path)
+    return True
+
+
+class BM25Index:
+    """lexical index over the same chunks (and point ids) as the vector store.
+    postings hold precomputed bm25 weights, so scoring a query is one
+    vectorized add per query term"""
+
+    def __init__(self, collection_name=None, index_dir=None, k1=1.5, b=0.75):
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.index_dir = index_dir or bm25_index_dir(self.collection_name)
+        self.docs_path = os.path.join(self.index_dir, "docs.json")
+        self.postings_path = os.path.join(self.index_dir, "postings.npz")
+        self.k1 = k1
+        self.b = b
+
+        self._load()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _load(self):
+        self.ids = []
+        self.texts = []
+        self.metadatas = []
+        self.vocab = {}
+        self._loaded_mtime = None
+
+        if os.path.exists(self.postings_path):
+            self._loaded_mtime = os.stat(self.postings_path).st_mtime_ns
+            with open(self.docs_path, encoding="utf-8") as f:
+                docs = json.load(f)
+            self.ids = docs["ids"]
+            self.texts = docs["texts"]
+            self.metadatas = docs["metadatas"]
+            self.vocab = docs["vocab"]
+
+            postings = np.load(self.postings_path)
+            self.offsets = postings["offsets"]
+            self.doc_ids = postings["doc_ids"]
+            self.weights = postings["weights"]
+        else:
+            self.offsets = np.zeros(1, dtype=np.int64)
+            self.doc_ids = np.empty(0, dtype=np.int32)
+            self.weights = np.empty(0, dtype=np.float32)
+
+        self._row_of = {point_id: row for row, point_id in enumerate(self.ids)}
+        self._build_masks()
+
+    def _build_masks(self):
+        sources = np.array([metadata.get("source") for metadata in self.metadatas])
+        self._source_masks = {
+            source: sources == source for source in set(sources.tolist())
+        }
+
+    def _refresh(self):
+        # pick up a rebuild written by another process (e.g. ingest.py)
+        if os.path.exists(self.postings_path):
+            if os.stat(self.postings_path).st_mtime_ns != self._loaded_mtime:
+                self._load()
+
+    def add(self, ids, texts, metadatas):
+        # called per ingest batch, so it only touches the batch: an id that is
+        # already indexed is replaced in place, new ones are appended
+        for point_id, text, metadata in zip(ids, texts, metadatas):
+            row = self._row_of.get(point_id)
+            if row is None:
+                self._row_of[point_id] = len(self.ids)
+                self.ids.append(point_id)
+                self.texts.append(text)
+                self.metadatas.append(metadata)
+            else:
+                self.texts[row] = text
+                self.metadatas[row] = metadata
+
+    def remove(self, ids):
+        ids = {point_id for point_id in ids if point_id in self._row_of}
+        if not ids:
+            return
+
+        keep = [i for i, point_id in enumerate(self.ids) if point_id not in ids]
+        self.ids = [self.ids[i] for i in keep]
+        self.texts = [self.texts[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        self._row_of = {point_id: row for row, point_id in enumerate(self.ids)}
+
+    def _build_postings(self):
+        term_counts = [Counter(tokenize(text)) for text in self.texts]
+        lengths = np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        avg_length = lengths.mean() if len(lengths) else 0.0
+
+        postings = {}
+        for doc_id, counts in enumerate(term_counts):
+            for term, tf in counts.items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(doc_id)
+                postings[term][1].append(tf)
+
+        self.vocab = {}
+        offsets = [0]
+        doc_id_parts = []
+        weight_parts = []
+        n = len(self.texts)
+
+        for term_id, (term, (doc_ids, tfs)) in enumerate(postings.items()):
+            doc_ids = np.array(doc_ids, dtype=np.int32)
+            tfs = np.array(tfs, dtype=np.float32)
+
+            idf = math.log(1 + (n - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * lengths[doc_ids] / avg_length)
+
+            self.vocab[term] = term_id
+            doc_id_parts.append(doc_ids)
+            weight_parts.append(idf * tfs * (self.k1 + 1) / (tfs + norm))
+            offsets.append(offsets[-1] + len(doc_ids))
+
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.doc_ids = np.concatenate(doc_id_parts) if doc_id_parts else np.empty(0, np.int32)
+        self.weights = (
+            np.concatenate(weight_parts).astype(np.float32)
+            if weight_parts
+            else np.empty(0, np.float32)
+        )
+
+    def save(self):
+        self._build_postings()
+        self._build_masks()
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        tmp_path = f"{self.docs_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "ids": self.ids,
+                    "texts": self.texts,
+                    "metadatas": self.metadatas,
+                    "vocab": self.vocab,
+                },
+                f,
+            )
+        os.replace(tmp_path, self.docs_path)
+
+        tmp_path = os.path.join(self.index_dir, "postings.tmp.npz")
+        np.savez(
+            tmp_path, offsets=self.offsets, doc_ids=self.doc_ids, weights=self.weights
+        )
+        os.replace(tmp_path, self.postings_path)
+        self._loaded_mtime = os.stat(self.postings_path).st_mtime_ns
+
+    def search(self, query, top_k=5, source_filter=None):
+        self._refresh()
+
+        scores = np.zeros(len(self.ids), dtype=np.float32)
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            # doc ids are unique within a posting list, so fancy-index add is safe
+            scores[self.doc_ids[start:end]] += self.weights[start:end]
+
+        if source_filter:
+            mask = self._source_masks.get(source_filter)
+            if mask is None:
+                return []
+            scores[~mask] = 0
+
+        matched = np.count_nonzero(scores)
+        k = min(top_k, matched)
+        if k <= 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+
+        return [
+            {
+                "id": self.ids[i],
+                "text": self.texts[i],
+                "metadata": self.metadatas[i],
+                "score": float(scores[i]),
+            }
+            for i in top
+        ]
@@ -0,0 +1,168 @@
+import json
+import mmap
+import os
+import threading
+import zlib
+from dotenv import load_dotenv
+
+from .paths import cache_path
+
+load_dotenv()
+
+
+class ChunkStore:
+    """chunk text and full metadata by point id, kept next to a lean qdrant
+    collection. records are zlib-compressed json appended to one data file
+    that readers access through mmap; a json index maps id -> (offset, length)"""
+
+    def __init__(self, collection_name=None, store_dir=None):
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.store_dir = store_dir or str(cache_path(f"chunks/{self.collection_name}"))
+        self.index_path = os.path.join(self.store_dir, "index.json")
+        self._lock = threading.Lock()
+        self._map = None
+
+        self._load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _load(self):
+        self.entries = {}
+        self.generation = 0
+        self.dead_bytes = 0
+        self._loaded_mtime = None
+
+        if os.path.exists(self.index_path):
+            self._loaded_mtime = os.stat(self.index_path).st_mtime_ns
+            with open(self.index_path, encoding="utf-8") as f:
+                index = json.load(f)
+            self.generation = index["generation"]
+            self.dead_bytes = index["dead_bytes"]
+            self.entries = {
+                point_id: (offset, length)
+                for point_id, offset, length in zip(
+                    index["ids"], index["offsets"], index["lengths"]
+                )
+            }
+
+        self._open_map()
+
+    def _data_path(self, generation=None):
+        # compaction writes a new generation, so open maps stay valid
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.store_dir, f"chunks.{generation}.bin")
+
+    def _open_map(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+        path = self._data_path()
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _refresh(self):
+        # pick up writes from another process (e.g. ingest.py)
+        if os.path.exists(self.index_path):
+            if os.stat(self.index_path).st_mtime_ns != self._loaded_mtime:
+                self._load()
+
+    def get_many(self, ids):
+        """(text, metadata) per id, None for ids the store doesn't have"""
+        with self._lock:
+            self._refresh()
+
+            records = []
+            for point_id in ids:
+                entry = self.entries.get(point_id)
+                if entry is None:
+                    records.append(None)
+                    continue
+
+                offset, length = entry
+                if self._map is None or offset + length > len(self._map):
+                    # appended after the map was opened
+                    self._open_map()
+                    if self._map is None or offset + length > len(self._map):
+                        records.append(None)
+                        continue
+                raw = self._map[offset : offset + length]
+                records.append(tuple(json.loads(zlib.decompress(raw))))
+
+            return records
+
+    def put_many(self, ids, texts, metadatas):
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        with self._lock, open(self._data_path(), "ab") as f:
+            offset = f.tell()
+            for point_id, text, metadata in zip(ids, texts, metadatas):
+                record = zlib.compress(json.dumps([text, metadata]).encode("utf-8"))
+                f.write(record)
+
+                replaced = self.entries.get(point_id)
+                if replaced is not None:
+                    self.dead_bytes += replaced[1]
+                self.entries[point_id] = (offset, len(record))
+                offset += len(record)
+
+    def delete(self, ids):
+        with self._lock:
+            for point_id in ids:
+                entry = self.entries.pop(point_id, None)
+                if entry is not None:
+                    self.dead_bytes += entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.dead_bytes += sum(length for _, length in self.entries.values())
+            self.entries = {}
+
+    def save(self):
+        with self._lock:
+            live_bytes = sum(length for _, length in self.entries.values())
+            old_path = None
+            if self.dead_bytes > live_bytes:
+                old_path = self._compact()
+
+            os.makedirs(self.store_dir, exist_ok=True)
+            ids = list(self.entries)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "generation": self.generation,
+                        "dead_bytes": self.dead_bytes,
+                        "ids": ids,
+                        "offsets": [self.entries[point_id][0] for point_id in ids],
+                        "lengths": [self.entries[point_id][1] for point_id in ids],
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.index_path)
+            self._loaded_mtime = os.stat(self.index_path).st_mtime_ns
+            self._open_map()
+
+            # only once the index points at the new generation
+            if old_path is not None and os.path.exists(old_path):
+                os.remove(old_path)
+
+    def _compact(self):
+        # copy live records into the next generation, then drop the old file
+        self._open_map()
+        old_path = self._data_path()
+        entries = {}
+
+        with open(self._data_path(self.generation + 1), "wb") as f:
+            offset = 0
+            for point_id, (start, length) in self.entries.items():
+                f.write(self._map[start : start + length])
+                entries[point_id] = (offset, length)
+                offset += length
+
+        self.entries = entries
+        self.generation += 1
+        self.dead_bytes = 0
+        return old_path
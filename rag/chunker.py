@@ -0,0 +1,205 @@
+from collections import deque
+
+# longest first, so "##" is never taken for "#"
+HEADERS = (("###", "Header_3"), ("##", "Header_2"), ("#", "Header_1"))
+SEPARATORS = ("\n\n", "\n", ". ", " ", "")
+
+
+class Document:
+    """compact stand-in for langchain's Document, used for whole files and
+    for chunks"""
+
+    __slots__ = ("page_content", "metadata")
+
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata if metadata is not None else {}
+
+    def __repr__(self):
+        return f"Document(page_content={self.page_content[:40]!r}, metadata={self.metadata!r})"
+
+
+def split_sections(text):
+    """(content, header metadata) per markdown section, with the same output
+    as langchain's MarkdownHeaderTextSplitter on HEADERS: headers stripped,
+    blank-line separated blocks under the same headers joined by "  \\n"."""
+    sections = []
+    lines = []
+    headers = {}
+    stack = []
+    metadata = {}
+    in_code = False
+    fence = ""
+
+    def flush(metadata):
+        content = "\n".join(lines)
+        lines.clear()
+        if sections and sections[-1][1] == metadata:
+            sections[-1][0].append(content)
+        else:
+            sections.append(([content], metadata))
+
+    for line in text.split("\n"):
+        stripped = line.strip()
+        if not stripped.isprintable():
+            stripped = "".join(filter(str.isprintable, stripped))
+
+        if not in_code:
+            if stripped.startswith("```") and stripped.count("```") == 1:
+                in_code, fence = True, "```"
+            elif stripped.startswith("~~~"):
+                in_code, fence = True, "~~~"
+        elif stripped.startswith(fence):
+            in_code, fence = False, ""
+
+        if in_code:
+            lines.append(stripped)
+            continue
+
+        for separator, name in HEADERS:
+            if stripped.startswith(separator) and (
+                len(stripped) == len(separator) or stripped[len(separator)] == " "
+            ):
+                level = len(separator)
+                while stack and stack[-1][0] >= level:
+                    headers.pop(stack.pop()[1], None)
+                stack.append((level, name))
+                headers[name] = stripped[len(separator) :].strip()
+
+                if lines:
+                    flush(metadata.copy())
+                break
+        else:
+            if stripped:
+                lines.append(stripped)
+            elif lines:
+                flush(metadata.copy())
+
+        metadata = headers.copy()
+
+    if lines:
+        flush(metadata)
+
+    return [("  \n".join(parts), metadata) for parts, metadata in sections]
+
+
+class MarkdownChunker:
+    """header-aware chunking in one pass per file: markdown sections, and
+    sections longer than chunk_size split the way langchain's
+    RecursiveCharacterTextSplitter does (separators kept at the start of
+    the following piece, overlap carried between chunks)"""
+
+    def __init__(self, chunk_size=1000, chunk_overlap=200, separators=SEPARATORS):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.separators = list(separators)
+
+    def split_text(self, text):
+        return self._split(text, self.separators)
+
+    def _split(self, text, separators):
+        # first separator present in the text, finer ones for oversized pieces
+        separator = separators[-1]
+        finer = []
+        for i, candidate in enumerate(separators):
+            if candidate == "":
+                separator = ""
+                break
+            if candidate in text:
+                separator = candidate
+                finer = separators[i + 1 :]
+                break
+
+        if separator:
+            parts = text.split(separator)
+            pieces = [parts[0]] + [separator + part for part in parts[1:]]
+        else:
+            pieces = list(text)
+
+        chunks = []
+        small = []
+        for piece in pieces:
+            if not piece:
+                continue
+            if len(piece) < self.chunk_size:
+                small.append(piece)
+                continue
+
+            if small:
+                chunks.extend(self._merge(small))
+                small = []
+            if finer:
+                chunks.extend(self._split(piece, finer))
+            else:
+                chunks.append(piece)
+
+        if small:
+            chunks.extend(self._merge(small))
+        return chunks
+
+    def _merge(self, pieces):
+        # pack pieces up to chunk_size, keeping up to chunk_overlap of the
+        # previous chunk's tail at the start of the next
+        chunks = []
+        current = deque()
+        total = 0
+
+        for piece in pieces:
+            length = len(piece)
+            if total + length > self.chunk_size and current:
+                chunk = "".join(current).strip()
+                if chunk:
+                    chunks.append(chunk)
+                while total > self.chunk_overlap or (
+                    total + length > self.chunk_size and total > 0
+                ):
+                    total -= len(current.popleft())
+            current.append(piece)
+            total += length
+
+        chunk = "".join(current).strip()
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def chunk(self, text, metadata):
+        """chunks of one file, with chunk_index/chunk_type/chunk_id/total_chunks
+        stamped as they are produced (chunk_id and total_chunks per file)"""
+        chunks = []
+
+        for content, headers in split_sections(text):
+            section_metadata = {**metadata}
+            for key, value in headers.items():
+                if value:
+                    section_metadata[key] = value
+
+            if len(content) > self.chunk_size:
+                pieces, chunk_type = self.split_text(content), "subsection"
+            else:
+                pieces, chunk_type = [content], "section"
+
+            for piece in pieces:
+                chunk_metadata = dict(section_metadata)
+                chunk_metadata["chunk_id"] = len(chunks)
+                chunk_metadata["chunk_index"] = len(chunks)
+                chunk_metadata["chunk_type"] = chunk_type
+                chunks.append(Document(piece, chunk_metadata))
+
+        for chunk in chunks:
+            chunk.metadata["total_chunks"] = len(chunks)
+        return chunks
+
+
+# one chunker per worker process, built on first use
+_worker_chunker = None
+
+
+def chunk_in_worker(chunk_size, chunk_overlap, files):
+    """chunks for a batch of (text, metadata) files, one list per file"""
+    global _worker_chunker
+    if _worker_chunker is None or (
+        _worker_chunker.chunk_size,
+        _worker_chunker.chunk_overlap,
+    ) != (chunk_size, chunk_overlap):
+        _worker_chunker = MarkdownChunker(chunk_size, chunk_overlap)
+    return [_worker_chunker.chunk(text, metadata) for text, metadata in files]
@@ -0,0 +1,151 @@
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# shortest suffix/prefix match treated as chunk overlap rather than coincidence
+MIN_OVERLAP = 20
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for english text with mistral's tokenizer
+    return (len(text) + 3) // 4
+
+
+def overlap_length(left, right):
+    # longest suffix of left that is also a prefix of right; candidate
+    # starts come from str.find, earliest (longest) first
+    if len(right) < MIN_OVERLAP:
+        return 0
+
+    probe = right[:MIN_OVERLAP]
+    start = max(0, len(left) - len(right))
+    while True:
+        start = left.find(probe, start)
+        if start == -1:
+            return 0
+        if right.startswith(left[start:]):
+            return len(left) - start
+        start += 1
+
+
+class ContextBuilder:
+    """turns retrieved chunks into a prompt context: neighbouring chunks of
+    the same file are merged with their overlap removed, then blocks are
+    added best score first until the token budget is spent"""
+
+    def __init__(self, token_budget=None):
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+
+        self.contexts = 0
+        self.tokens_used = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def _merge(self, results):
+        files = {}
+        for result in results:
+            metadata = result["metadata"]
+            key = (metadata.get("source"), metadata.get("file_name"))
+            files.setdefault(key, []).append(result)
+
+        blocks = []
+        for group in files.values():
+            group.sort(key=lambda result: result["metadata"].get("chunk_index", -1))
+            block = None
+
+            for result in group:
+                text = result["text"]
+                position = result["metadata"].get("chunk_index")
+                score = result.get("score", 0.0)
+
+                if block is not None and text in block["text"]:
+                    # duplicate (e.g. the same chunk from vector and bm25 search)
+                    block["score"] = max(block["score"], score)
+                    continue
+
+                adjacent = (
+                    block is not None
+                    and position is not None
+                    and block["end"] is not None
+                    and position == block["end"] + 1
+                )
+                if adjacent:
+                    overlap = overlap_length(block["text"], text)
+                    separator = "" if overlap else "\n\n"
+                    block["text"] += separator + text[overlap:]
+                    block["end"] = position
+                    block["score"] = max(block["score"], score)
+                    block["chunks"] += 1
+                    continue
+
+                block = {
+                    "text": text,
+                    "metadata": result["metadata"],
+                    "score": score,
+                    "end": position,
+                    "chunks": 1,
+                }
+                blocks.append(block)
+
+        blocks.sort(key=lambda block: block["score"], reverse=True)
+        return blocks
+
+    def build(self, results, naive_context=None):
+        blocks = self._merge(results)
+        budget = self.token_budget
+
+        context_parts = []
+        dropped = 0
+        for block in blocks:
+            metadata = block["metadata"]
+            source = metadata.get("source", "Unknown")
+            title = metadata.get("title", metadata.get("file_name", "Unknown"))
+            header = f"Source {len(context_parts) + 1} ({source} - {title}):"
+
+            part = f"{header}\n{block['text']}\n"
+            tokens = estimate_tokens(part)
+
+            if tokens > budget:
+                if context_parts:
+                    # a lower scored block may still fit
+                    dropped += 1
+                    continue
+
+                # never send an empty context: cut the best block to size
+                text = block["text"][: max(0, budget * 4 - len(header) - 2)]
+                text = text.rsplit(" ", 1)[0] if " " in text else text
+                part = f"{header}\n{text}\n"
+                tokens = estimate_tokens(part)
+
+            context_parts.append(part)
+            budget -= tokens
+
+        context = "\n".join(context_parts)
+
+        used = estimate_tokens(context)
+        naive = estimate_tokens(naive_context) if naive_context is not None else used
+        report = {
+            "chunks": len(results),
+            "blocks": len(context_parts),
+            "dropped": dropped,
+            "tokens": used,
+            "tokens_saved": max(0, naive - used),
+        }
+
+        with self._lock:
+            self.contexts += 1
+            self.tokens_used += used
+            self.tokens_saved += report["tokens_saved"]
+
+        return context, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "contexts": self.contexts,
+                "tokens_used": self.tokens_used,
+                "tokens_saved": self.tokens_saved,
+                "token_budget": self.token_budget,
+            }
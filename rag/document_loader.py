@@ -1,51 +1,75 @@
 from pathlib import Path
 import os
-from langchain.text_splitter import (
-    MarkdownHeaderTextSplitter,
-    RecursiveCharacterTextSplitter,
-)
-from langchain.schema import Document
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
 from dotenv import load_dotenv
 
+from .chunker import Document, MarkdownChunker, chunk_in_worker
+from .metrics import record_error
+
 load_dotenv()
 
 
 class DocumentLoader:
-    def __init__(self):
+    def __init__(self, chunk_size=None, chunk_overlap=None):
         self.data_dir = Path(__file__).parent.parent / "data"
         self.sources = ["manual", "docs", "handbook"]
-        self.chunk_size = int(os.getenv("CHUNK_SIZE", "1000"))
-        self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "200"))
-
-        # first split by markdown headers
-        self.header_splitter = MarkdownHeaderTextSplitter(
-            headers_to_split_on=[
-                ("#", "Header_1"),
-                ("##", "Header_2"),
-                ("###", "Header_3"),
-            ]
+        # explicit values win over the env, e.g. for parameter sweeps
+        self.chunk_size = chunk_size or int(os.getenv("CHUNK_SIZE", "1000"))
+        self.chunk_overlap = (
+            chunk_overlap if chunk_overlap is not None else int(os.getenv("CHUNK_OVERLAP", "200"))
         )
 
-        # then split large sections into smaller chunks
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            separators=["\n\n", "\n", ". ", " ", ""],
-            length_function=len,
-        )
+        # native is a dependency-free port of the langchain splitters below
+        self.chunker = os.getenv("CHUNKER", "native")
+        self.workers = int(os.getenv("CHUNK_WORKERS", "1"))
+        self._pool = None
+
+        if self.chunker == "langchain":
+            from langchain_text_splitters import (
+                MarkdownHeaderTextSplitter,
+                RecursiveCharacterTextSplitter,
+            )
+
+            # first split by markdown headers
+            self.header_splitter = MarkdownHeaderTextSplitter(
+                headers_to_split_on=[
+                    ("#", "Header_1"),
+                    ("##", "Header_2"),
+                    ("###", "Header_3"),
+                ]
+            )
+
+            # then split large sections into smaller chunks
+            self.text_splitter = RecursiveCharacterTextSplitter(
+                chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap,
+                separators=["\n\n", "\n", ". ", " ", ""],
+                length_function=len,
+            )
+        else:
+            self.markdown_chunker = MarkdownChunker(self.chunk_size, self.chunk_overlap)
+
+    def settings(self):
+        """everything that changes the chunks produced from the same file"""
+        return {
+            "chunker": self.chunker,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+        }
 
     def load_documents(self):
-        documents = []
+        return list(self.iter_documents())
 
+    def iter_documents(self):
+        # one file in memory at a time, for the streaming ingest pipeline
         for source in self.sources:
             source_dir = self.data_dir / source
             if source_dir.exists():
                 for file_path in source_dir.glob("*.md"):
                     doc = self._load_single_document(file_path, source)
                     if doc:
-                        documents.append(doc)
-
-        return documents
+                        yield doc
 
     def _load_single_document(self, file_path, source):
         try:
@@ -65,6 +89,7 @@ class DocumentLoader:
 
         except Exception as e:
             print(f"error: {e}")
+            record_error("load")
             return None
 
     def _extract_title(self, content):
@@ -99,44 +124,103 @@ class DocumentLoader:
 
     def chunk_documents(self, documents):
         chunks = []
+        for file_chunks in self.iter_file_chunks(documents):
+            chunks.extend(file_chunks)
+
+        # chunk ids and totals span the whole batch
+        for chunk_id, chunk in enumerate(chunks):
+            chunk.metadata["chunk_id"] = chunk_id
+            chunk.metadata["total_chunks"] = len(chunks)
+
+        return chunks
 
+    def iter_file_chunks(self, documents):
+        """chunks of each document in order, one list per file, with
+        chunk_id and total_chunks counted within the file"""
+        if self.chunker == "langchain":
+            for doc in documents:
+                yield self._chunk_with_langchain(doc)
+            return
+
+        if self.workers <= 1:
+            for doc in documents:
+                yield self.markdown_chunker.chunk(doc.page_content, doc.metadata)
+            return
+
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+
+        def submit(files):
+            return self._pool.submit(
+                chunk_in_worker, self.chunk_size, self.chunk_overlap, files
+            )
+
+        # files go to the pool in small batches to amortize the ipc, and a
+        # bounded window of batches in flight keeps order and memory flat
+        pending = deque()
+        files = []
         for doc in documents:
-            # first split by headers to maintain markdown structure
-            header_splits = self.header_splitter.split_text(doc.page_content)
-
-            # process each header-based section
-            for header_doc in header_splits:
-                # create a document with combined metadata
-                section_metadata = {**doc.metadata}
-
-                # add header hierarchy to metadata if present
-                if hasattr(header_doc, "metadata") and header_doc.metadata:
-                    for key, value in header_doc.metadata.items():
-                        if value:  # only add non-empty header values
-                            section_metadata[key] = value
-
-                # create document for this section
-                if hasattr(header_doc, "page_content"):
-                    content = header_doc.page_content
-                else:
-                    content = str(header_doc)
-
-                section_doc = Document(page_content=content, metadata=section_metadata)
-
-                # if section is still too large, split it further
-                if len(content) > self.chunk_size:
-                    sub_chunks = self.text_splitter.split_documents([section_doc])
-                    for i, chunk in enumerate(sub_chunks):
-                        chunk.metadata["chunk_id"] = len(chunks)
-                        chunk.metadata["chunk_type"] = "subsection"
-                        chunks.append(chunk)
-                else:
-                    section_doc.metadata["chunk_id"] = len(chunks)
-                    section_doc.metadata["chunk_type"] = "section"
-                    chunks.append(section_doc)
+            files.append((doc.page_content, doc.metadata))
+            if len(files) >= 16:
+                pending.append(submit(files))
+                files = []
+
+            while len(pending) >= self.workers * 2:
+                yield from pending.popleft().result()
+
+        if files:
+            pending.append(submit(files))
+        while pending:
+            yield from pending.popleft().result()
+
+    def _chunk_with_langchain(self, doc):
+        from langchain_core.documents import Document as LangchainDocument
+
+        chunks = []
+
+        # first split by headers to maintain markdown structure
+        header_splits = self.header_splitter.split_text(doc.page_content)
+
+        # process each header-based section
+        for header_doc in header_splits:
+            # create a document with combined metadata
+            section_metadata = {**doc.metadata}
+
+            # add header hierarchy to metadata if present
+            if hasattr(header_doc, "metadata") and header_doc.metadata:
+                for key, value in header_doc.metadata.items():
+                    if value:  # only add non-empty header values
+                        section_metadata[key] = value
+
+            # create document for this section
+            if hasattr(header_doc, "page_content"):
+                content = header_doc.page_content
+            else:
+                content = str(header_doc)
+
+            section_doc = LangchainDocument(page_content=content, metadata=section_metadata)
+
+            # if section is still too large, split it further
+            if len(content) > self.chunk_size:
+                sub_chunks = self.text_splitter.split_documents([section_doc])
+                for chunk in sub_chunks:
+                    chunk.metadata["chunk_id"] = len(chunks)
+                    chunk.metadata["chunk_index"] = len(chunks)
+                    chunk.metadata["chunk_type"] = "subsection"
+                    chunks.append(chunk)
+            else:
+                section_doc.metadata["chunk_id"] = len(chunks)
+                section_doc.metadata["chunk_index"] = len(chunks)
+                section_doc.metadata["chunk_type"] = "section"
+                chunks.append(section_doc)
 
         # update total chunks count
         for chunk in chunks:
             chunk.metadata["total_chunks"] = len(chunks)
 
         return chunks
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
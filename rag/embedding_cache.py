@@ -0,0 +1,252 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+from dotenv import load_dotenv
+
+from .paths import cache_path
+
+try:
+    import fcntl
+except ImportError:  # windows: single process only
+    fcntl = None
+
+load_dotenv()
+
+KEY_BYTES = 16
+
+
+class EmbeddingCache:
+    """on-disk lru cache of embeddings: float32 memmap rows plus a json index,
+    safe to share between processes (e.g. the api and an ingest run).
+
+    new vectors are kept in memory until save(), which takes a file lock,
+    merges them into the index on disk and only then picks their rows. every
+    row is tagged with its key, so a process holding an older index never
+    returns a row that another process has since reused"""
+
+    def __init__(self, cache_dir=None, max_entries=None):
+        self.cache_dir = cache_dir or cache_path("embeddings")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.keys_path = os.path.join(self.cache_dir, "keys.bin")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.lock_path = os.path.join(self.cache_dir, "lock")
+        self.max_entries = max_entries or int(
+            os.getenv("EMBEDDING_CACHE_SIZE", "100000")
+        )
+
+        self.hits = 0
+        self.misses = 0
+        self.dim = None
+        self.capacity = 0
+        self.unsaved = 0
+
+        self._rows = OrderedDict()  # key -> row, as of the last load or save
+        self._pending = OrderedDict()  # key -> vector, not yet on disk
+        self._touched = set()  # keys read since the last save, for lru order
+        self._vectors = None
+        self._keys = None
+        # _lock guards the in-memory state and is only held briefly;
+        # _save_lock keeps one save at a time, so the disk work of a save
+        # (possibly on a worker thread) doesn't block get() and put()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        with self._file_lock():
+            index = self._read_index()
+            if index is not None:
+                self.dim, capacity, self._rows = index
+                if capacity:
+                    self._open(capacity)
+        atexit.register(self.save)
+
+    @staticmethod
+    def key(model, input_type, text):
+        raw = f"{model}\0{input_type}\0{text}".encode("utf-8")
+        return hashlib.sha256(raw).hexdigest()[:32]
+
+    @contextmanager
+    def _file_lock(self):
+        # serializes row allocation and index writes across processes
+        if fcntl is None:
+            yield
+            return
+
+        with open(self.lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        # (dim, capacity, rows) as saved on disk, or None; called with the
+        # file lock held
+        if not os.path.exists(self.index_path):
+            return None
+
+        with open(self.index_path, encoding="utf-8") as f:
+            index = json.load(f)
+
+        # caches written before rows were tagged can't be verified
+        if not os.path.exists(self.keys_path):
+            return None
+
+        rows = OrderedDict((key, row) for key, row in index["rows"])
+        return index["dim"], index["capacity"], rows
+
+    def _open(self, capacity):
+        # files only ever grow: another process may have them mapped, and
+        # shrinking a mapped file faults its readers
+        for path, row_bytes in (
+            (self.vectors_path, self.dim * 4),
+            (self.keys_path, KEY_BYTES),
+        ):
+            with open(path, "ab") as f:
+                if f.tell() < capacity * row_bytes:
+                    f.truncate(capacity * row_bytes)
+
+        if capacity == self.capacity and self._vectors is not None:
+            return
+
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r+", shape=(capacity, self.dim)
+        )
+        self._keys = np.memmap(
+            self.keys_path, dtype=np.uint8, mode="r+", shape=(capacity, KEY_BYTES)
+        )
+        self.capacity = capacity
+
+    def _read(self, key, row):
+        # the tag is checked before and after the copy, so a row being
+        # rewritten by another process reads as a miss, not a wrong vector
+        tag = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+        if row >= self.capacity or not np.array_equal(self._keys[row], tag):
+            return None
+        vector = self._vectors[row].tolist()
+        if not np.array_equal(self._keys[row], tag):
+            return None
+        return vector
+
+    def get(self, key):
+        with self._lock:
+            vector = self._pending.get(key)
+            if vector is None:
+                row = self._rows.get(key)
+                if row is not None:
+                    vector = self._read(key, row)
+                    if vector is None:
+                        del self._rows[key]
+
+            if vector is None:
+                self.misses += 1
+                return None
+
+            self._touched.add(key)
+            self.hits += 1
+            return list(vector)
+
+    def put(self, key, vector):
+        with self._lock:
+            if self.dim is None:
+                self.dim = len(vector)
+            elif len(vector) != self.dim:
+                return
+
+            self._pending[key] = list(vector)
+            self._pending.move_to_end(key)
+            self.unsaved += 1
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                if not self._pending and not self._touched:
+                    return
+                # what this save writes; puts made meanwhile wait for the next
+                snapshot = list(self._pending.items())
+                touched, self._touched = self._touched, set()
+                rows = OrderedDict(self._rows)
+
+            with self._file_lock():
+                self._write(snapshot, touched, rows)
+
+            with self._lock:
+                self._rows = rows
+                for key, vector in snapshot:
+                    if self._pending.get(key) is vector:
+                        del self._pending[key]
+                self.unsaved = len(self._pending)
+
+    def _write(self, snapshot, touched, rows):
+        # called with the file lock held. rows starts as this process's view
+        # and ends as the saved index; a row is untagged while it's rewritten,
+        # so a get() still using the old view misses instead of misreading
+        index = self._read_index()
+        if index is not None:
+            # start from what other processes have saved since
+            dim, capacity, saved = index
+            self.dim = self.dim or dim
+            rows.clear()
+            rows.update(saved)
+            if capacity > self.capacity:
+                self._open(capacity)
+
+        for key in touched:
+            if key in rows:
+                rows.move_to_end(key)
+
+        pending = [
+            (key, vector)
+            for key, vector in snapshot
+            if key not in rows and len(vector) == self.dim
+        ]
+        while rows and len(rows) + len(pending) > self.max_entries:
+            rows.popitem(last=False)
+        pending = pending[-self.max_entries :]
+
+        if pending:
+            used = set(rows.values())
+            free = [row for row in range(self.capacity) if row not in used]
+            if len(free) < len(pending):
+                # double the files until the row bound is reached
+                capacity = max(1024, self.capacity * 2, self.capacity + len(pending))
+                capacity = max(min(capacity, self.max_entries), self.capacity + len(pending))
+                free += range(self.capacity, capacity)
+                self._open(capacity)
+
+            for (key, vector), row in zip(pending, free):
+                # untag, write, retag: readers never match a half-written row
+                self._keys[row] = 0
+                self._vectors[row] = vector
+                self._keys[row] = np.frombuffer(bytes.fromhex(key), dtype=np.uint8)
+                rows[key] = row
+
+            self._vectors.flush()
+            self._keys.flush()
+
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "dim": self.dim,
+                    "capacity": self.capacity,
+                    "rows": list(rows.items()),
+                },
+                f,
+            )
+        os.replace(tmp_path, self.index_path)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._rows) + len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
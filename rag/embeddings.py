@@ -1,44 +1,256 @@
+import asyncio
 import os
+import random
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 from dotenv import load_dotenv
 import cohere
+import httpx
+
+from .embedding_cache import EmbeddingCache
+from .metrics import record_error
+from .rate_limit import TokenBucket
 
 load_dotenv()
 
 
+def _status_code(error):
+    # only the sdk's typed fields count: a message can mention "429" for
+    # any reason. None (network errors, timeouts) means retry
+    if isinstance(error, getattr(cohere, "TooManyRequestsError", ())):
+        return 429
+    # cohere sdk versions disagree on the attribute name
+    for attr in ("status_code", "http_status"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
 class EmbeddingService:
     def __init__(self):
         self.client = cohere.Client(os.getenv("COHERE_API_KEY"))
         self.model = os.getenv("EMBEDDING_MODEL", "embed-english-v3.0")
         self.batch_size = 96
 
+        # concurrent batches share one adaptive rate limit
+        self.concurrency = int(os.getenv("EMBED_CONCURRENCY", "4"))
+        self.max_retries = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+        self.rate_limiter = TokenBucket(rate=float(os.getenv("EMBED_RATE_LIMIT", "10")))
+
+        # batches that still failed after retries
+        self.dead_letters = []
+        self.zero_vector_fallbacks = 0
+
+        # persistent cache so unchanged text is never sent to cohere twice
+        self.cache = None
+        if os.getenv("EMBEDDING_CACHE", "1") != "0":
+            self.cache = EmbeddingCache()
+
     def embed_texts(self, texts):
-        embeddings = []
+        # failed texts come back as None rather than poisoning the index
+        if self.cache is None:
+            return self._embed_documents(texts)
+
+        keys = [self.cache.key(self.model, "search_document", text) for text in texts]
+        embeddings = [self.cache.get(key) for key in keys]
 
-        for i in range(0, len(texts), self.batch_size):
-            batch = texts[i : i + self.batch_size]
+        # only cache misses go to the api
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            fresh = self._embed_documents([texts[i] for i in missing])
+
+            for i, embedding in zip(missing, fresh):
+                embeddings[i] = embedding
+                if embedding is not None:
+                    self.cache.put(keys[i], embedding)
+
+            self.cache.save()
+
+        return embeddings
+
+    def _embed_batch(self, texts, input_type, max_retries):
+        for attempt in range(max_retries + 1):
+            self.rate_limiter.acquire()
 
             try:
                 response = self.client.embed(
-                    texts=batch, model=self.model, input_type="search_document"
+                    texts=texts, model=self.model, input_type=input_type
                 )
-                embeddings.extend(response.embeddings)
+                self.rate_limiter.on_success()
+                return response.embeddings
+
+            except Exception as e:
+                status = _status_code(e)
+                if status == 429:
+                    self.rate_limiter.on_throttle()
+                elif status is not None and status < 500:
+                    # bad request, auth etc. won't succeed on retry
+                    raise
 
-                if i + self.batch_size < len(texts):
-                    sleep(0.1)
+                if attempt == max_retries:
+                    raise
 
+                # exponential backoff with jitter
+                sleep(min(30.0, 0.5 * 2**attempt) * (0.5 + random.random()))
+
+    def _embed_documents(self, texts):
+        batches = [
+            texts[i : i + self.batch_size] for i in range(0, len(texts), self.batch_size)
+        ]
+
+        def embed(batch_number):
+            batch = batches[batch_number]
+            try:
+                return self._embed_batch(batch, "search_document", self.max_retries)
+            except Exception as e:
+                print(f"error: batch {batch_number} failed after retries: {e}")
+                record_error("embed_batch")
+                self.dead_letters.append(
+                    {"batch": batch_number, "texts": batch, "error": str(e)}
+                )
+                return [None] * len(batch)
+
+        embeddings = []
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            # map keeps batch order
+            for batch_embeddings in executor.map(embed, range(len(batches))):
+                embeddings.extend(batch_embeddings)
+
+        return embeddings
+
+    def embed_queries(self, queries):
+        # one api call per 96 uncached queries instead of one per query
+        keys = [None] * len(queries)
+        embeddings = [None] * len(queries)
+        if self.cache is not None:
+            keys = [self.cache.key(self.model, "search_query", query) for query in queries]
+            embeddings = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+
+            try:
+                fresh = self._embed_batch(
+                    [queries[i] for i in batch], "search_query", max_retries=2
+                )
             except Exception as e:
-                print(f"error: batch {i//self.batch_size}")
-                embeddings.extend([[0.0] * 1024] * len(batch))
+                print(f"error: query embedding: {e}")
+                record_error("query_embedding")
+                self.zero_vector_fallbacks += len(batch)
+                for i in batch:
+                    embeddings[i] = [0.0] * 1024
+                continue
+
+            for i, embedding in zip(batch, fresh):
+                embeddings[i] = embedding
+                if keys[i] is not None:
+                    self.cache.put(keys[i], embedding)
+
+        if missing and self.cache is not None:
+            self.cache.save()
 
         return embeddings
 
     def embed_query(self, query):
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.model, "search_query", query)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
         try:
-            response = self.client.embed(
-                texts=[query], model=self.model, input_type="search_query"
-            )
-            return response.embeddings[0]
+            # a user is waiting, so retry less
+            embedding = self._embed_batch([query], "search_query", max_retries=2)[0]
         except Exception as e:
-            print(f"error: query embedding")
+            print(f"error: query embedding: {e}")
+            record_error("query_embedding")
+            self.zero_vector_fallbacks += 1
             return [0.0] * 1024
+
+        if key is not None:
+            self.cache.put(key, embedding)
+            # queries arrive one at a time, so persist the index in batches
+            if self.cache.unsaved >= 32:
+                self.cache.save()
+
+        return embedding
+
+
+class AsyncEmbeddingService:
+    """query-side embedding for the event loop; shares the on-disk cache
+    format with EmbeddingService and keeps one pooled http client"""
+
+    def __init__(self):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=int(os.getenv("COHERE_MAX_CONNECTIONS", "32"))),
+            timeout=30.0,
+        )
+        self.client = cohere.AsyncClient(
+            os.getenv("COHERE_API_KEY"), httpx_client=self.http_client
+        )
+        self.model = os.getenv("EMBEDDING_MODEL", "embed-english-v3.0")
+        self.batch_size = 96
+        self.zero_vector_fallbacks = 0
+
+        self.cache = None
+        if os.getenv("EMBEDDING_CACHE", "1") != "0":
+            self.cache = EmbeddingCache()
+
+    async def _embed_batch(self, texts, max_retries=2):
+        for attempt in range(max_retries + 1):
+            try:
+                response = await self.client.embed(
+                    texts=texts, model=self.model, input_type="search_query"
+                )
+                return response.embeddings
+
+            except Exception as e:
+                status = _status_code(e)
+                if status is not None and status != 429 and status < 500:
+                    raise
+                if attempt == max_retries:
+                    raise
+
+                await asyncio.sleep(min(30.0, 0.5 * 2**attempt) * (0.5 + random.random()))
+
+    async def embed_queries(self, queries):
+        keys = [None] * len(queries)
+        embeddings = [None] * len(queries)
+        if self.cache is not None:
+            keys = [self.cache.key(self.model, "search_query", query) for query in queries]
+            embeddings = [self.cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start : start + self.batch_size]
+
+            try:
+                fresh = await self._embed_batch([queries[i] for i in batch])
+            except Exception as e:
+                print(f"error: query embedding: {e}")
+                record_error("query_embedding")
+                self.zero_vector_fallbacks += len(batch)
+                for i in batch:
+                    embeddings[i] = [0.0] * 1024
+                continue
+
+            for i, embedding in zip(batch, fresh):
+                embeddings[i] = embedding
+                if keys[i] is not None:
+                    self.cache.put(keys[i], embedding)
+
+        # queries arrive one at a time, so persist the index in batches, on
+        # a worker thread: a save takes a file lock and rewrites the index
+        if self.cache is not None and self.cache.unsaved >= 32:
+            await asyncio.to_thread(self.cache.save)
+
+        return embeddings
+
+    async def embed_query(self, query):
+        return (await self.embed_queries([query]))[0]
+
+    async def close(self):
+        await self.http_client.aclose()
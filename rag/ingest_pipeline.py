@@ -0,0 +1,344 @@
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from dotenv import load_dotenv
+
+from .manifest import chunk_point_id, content_hash, file_key
+
+load_dotenv()
+
+# end-of-stream marker passed down the queues
+_DONE = object()
+
+
+class _Stopped(Exception):
+    """another stage failed, unwind this one"""
+
+
+class StageStats:
+    """items through a stage and time spent working vs waiting on neighbours"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - (self.started or time.perf_counter())
+        return {
+            "items": self.items,
+            "seconds": elapsed,
+            "busy_seconds": self.busy,
+            "items_per_second": self.items / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class IngestPipeline:
+    """load -> chunk -> embed -> upsert, one thread per stage joined by
+    bounded queues. only a few batches are in memory at once, and a slow
+    stage back-pressures the ones before it instead of the run
+    materializing every document, chunk and embedding up front"""
+
+    def __init__(
+        self,
+        loader,
+        embeddings,
+        vector_store,
+        manifest,
+        dead_letters,
+        bm25,
+        full=False,
+        sources=None,
+        queue_size=None,
+        embed_batch=None,
+        upsert_batch=None,
+    ):
+        self.loader = loader
+        self.embeddings = embeddings
+        self.vector_store = vector_store
+        self.manifest = manifest
+        self.dead_letters = dead_letters
+        # None outside hybrid retrieval, where nothing reads the lexical index
+        self.bm25 = bm25
+        self.full = full
+        # limits removals and dead-letter bookkeeping to these sources, for
+        # re-ingesting one source; None means the run covers every source
+        self.sources = set(sources) if sources else None
+
+        self.queue_size = queue_size or int(os.getenv("INGEST_QUEUE_SIZE", "4"))
+        # enough texts per hand-off to keep every embedding worker busy
+        self.embed_batch = embed_batch or embeddings.batch_size * max(1, embeddings.concurrency)
+        self.upsert_batch = upsert_batch or int(os.getenv("INGEST_UPSERT_BATCH", "1024"))
+
+        self.stats = {name: StageStats(name) for name in ("load", "chunk", "embed", "upsert")}
+
+        # filled in by the stages, read once they have all finished
+        self.current = set()
+        self.hashes = {}
+        self.changed = []
+        self.file_ids = {}
+        self.retried = []
+        self.failed = []
+        self.lexical_added = 0
+
+        # with an empty bm25 index every current chunk is added to it, not
+        # only new ones; set by run()
+        self.bootstrap = False
+        self._lexical_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _in_scope(self, key):
+        return self.sources is None or key.split("/", 1)[0] in self.sources
+
+    def _add_lexical(self, items):
+        # fed batch by batch from the chunk and upsert stages
+        if self.bm25 is None or not items:
+            return
+        with self._lexical_lock:
+            self.bm25.add(
+                [item["id"] for item in items],
+                [item["text"] for item in items],
+                [item["metadata"] for item in items],
+            )
+            self.lexical_added += len(items)
+
+    def _put(self, q, item):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q):
+        while True:
+            if self._stop.is_set():
+                raise _Stopped()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _stage(self, name, work, inbox, outbox):
+        stats = self.stats[name]
+        stats.started = time.perf_counter()
+
+        try:
+            work(stats, inbox, outbox)
+            if outbox is not None:
+                self._put(outbox, _DONE)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop.set()
+        finally:
+            stats.finished = time.perf_counter()
+
+    def _items(self, stats, inbox):
+        # yields work from the inbox, timing only the work, not the waiting
+        while True:
+            item = self._get(inbox)
+            if item is _DONE:
+                return
+            start = time.perf_counter()
+            yield item
+            stats.busy += time.perf_counter() - start
+
+    def _load(self, stats, inbox, outbox):
+        for doc in self.loader.iter_documents():
+            start = time.perf_counter()
+            key = file_key(doc.metadata)
+            self.current.add(key)
+            self.hashes[key] = content_hash(doc.page_content)
+            stats.items += 1
+
+            changed = self.full or not self.manifest.is_unchanged(key, self.hashes[key])
+            if changed:
+                self.changed.append(key)
+                self.file_ids[key] = set()
+            stats.busy += time.perf_counter() - start
+
+            # unchanged files only need chunking when the lexical index is new
+            if changed or self.bootstrap:
+                self._put(outbox, doc)
+
+    def _chunk(self, stats, inbox, outbox):
+        batch = []
+        # already-stored chunks that only the lexical index still needs
+        lexical = []
+
+        # the loader may chunk several files at once on a process pool
+        for chunks in self.loader.iter_file_chunks(self._items(stats, inbox)):
+            for chunk in chunks:
+                key = file_key(chunk.metadata)
+                stats.items += 1
+                point_id = chunk_point_id(
+                    key, chunk.metadata["chunk_index"], chunk.page_content
+                )
+                item = {
+                    "id": point_id,
+                    "file": key,
+                    "text": chunk.page_content,
+                    "metadata": chunk.metadata,
+                }
+                if key not in self.file_ids:
+                    lexical.append(item)
+                    continue
+                self.file_ids[key].add(point_id)
+
+                # chunks whose id already exists are identical to what's stored
+                if self.full or point_id not in self.manifest.point_ids(key):
+                    batch.append(item)
+                elif self.bootstrap:
+                    lexical.append(item)
+
+            if len(lexical) >= self.embed_batch:
+                self._add_lexical(lexical)
+                lexical = []
+
+            if len(batch) >= self.embed_batch:
+                self._put(outbox, batch)
+                batch = []
+
+        # retry chunks that failed last time; changed files were re-chunked above
+        # (the load stage has finished, so self.current is complete)
+        self.retried = [
+            item
+            for item in self.dead_letters.items
+            if item["file"] in self.current and item["file"] not in self.file_ids
+        ]
+        batch.extend(self.retried)
+        self._add_lexical(lexical)
+
+        for start in range(0, len(batch), self.embed_batch):
+            self._put(outbox, batch[start : start + self.embed_batch])
+
+    def _embed(self, stats, inbox, outbox):
+        for batch in self._items(stats, inbox):
+            embeddings = self.embeddings.embed_texts([item["text"] for item in batch])
+            stats.items += len(batch)
+
+            # failed chunks are not uploaded, they wait in the dead-letter list
+            embedded = []
+            for item, embedding in zip(batch, embeddings):
+                if embedding is None:
+                    self.failed.append(item)
+                else:
+                    embedded.append((item, embedding))
+
+            if embedded:
+                self._put(outbox, embedded)
+
+    def _upsert(self, stats, inbox, outbox):
+        buffered = []
+
+        def flush():
+            self.vector_store.add_documents(
+                [item["text"] for item, _ in buffered],
+                [embedding for _, embedding in buffered],
+                [item["metadata"] for item, _ in buffered],
+                ids=[item["id"] for item, _ in buffered],
+            )
+            stats.items += len(buffered)
+            self._add_lexical([item for item, _ in buffered])
+            buffered.clear()
+
+        for embedded in self._items(stats, inbox):
+            buffered.extend(embedded)
+            if len(buffered) >= self.upsert_batch:
+                flush()
+
+        if buffered:
+            start = time.perf_counter()
+            flush()
+            stats.busy += time.perf_counter() - start
+
+    def run(self):
+        documents = queue.Queue(maxsize=self.queue_size)
+        chunks = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        self.bootstrap = self.bm25 is not None and not len(self.bm25)
+
+        threads = [
+            threading.Thread(target=self._stage, args=("load", self._load, None, documents)),
+            threading.Thread(target=self._stage, args=("chunk", self._chunk, documents, chunks)),
+            threading.Thread(target=self._stage, args=("embed", self._embed, chunks, embedded)),
+            threading.Thread(target=self._stage, args=("upsert", self._upsert, embedded, None)),
+        ]
+
+        # stores that rewrite files on every call (the local backend) write
+        # once at the end instead
+        bulk = getattr(self.vector_store, "bulk", None)
+        with bulk() if bulk is not None else nullcontext():
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            if self._errors:
+                raise self._errors[0]
+
+            removed = [
+                key for key in self.manifest.removed_keys(self.current) if self._in_scope(key)
+            ]
+            # grouped by source, so a sharded store only touches the affected shards
+            stale_by_source = {}
+            for key in removed:
+                stale_by_source.setdefault(key.split("/", 1)[0], []).extend(
+                    self.manifest.point_ids(key)
+                )
+            for key, ids in self.file_ids.items():
+                stale_by_source.setdefault(key.split("/", 1)[0], []).extend(
+                    self.manifest.point_ids(key) - ids
+                )
+
+            stale_ids = []
+            for source, ids in stale_by_source.items():
+                if ids:
+                    self.vector_store.delete_points(ids, source=source)
+                    stale_ids.extend(ids)
+
+        # keep the bm25 index in step with the vector store
+        if self.bm25 is not None and (self.lexical_added or stale_ids):
+            self.bm25.remove(stale_ids)
+            self.bm25.save()
+
+        # record what the collection now holds
+        failed_ids = {item["id"] for item in self.failed}
+        for key in self.changed:
+            self.manifest.update(key, self.hashes[key], self.file_ids[key] - failed_ids)
+        for item in self.retried:
+            if item["id"] not in failed_ids:
+                self.manifest.update(
+                    item["file"],
+                    self.hashes[item["file"]],
+                    self.manifest.point_ids(item["file"]) | {item["id"]},
+                )
+        for key in removed:
+            self.manifest.remove(key)
+        self.manifest.save()
+        # dead letters of sources outside this run wait for their own
+        self.dead_letters.save(
+            self.failed
+            + [item for item in self.dead_letters.items if not self._in_scope(item["file"])]
+        )
+
+        return {
+            "documents": len(self.current),
+            "changed": len(self.changed),
+            "removed": len(removed),
+            "retried": len(self.retried),
+            "failed": len(self.failed),
+            "stale": len(stale_ids),
+            "bm25_chunks": len(self.bm25) if self.bm25 is not None else None,
+            "stages": {name: stats.summary() for name, stats in self.stats.items()},
+        }
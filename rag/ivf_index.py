@@ -0,0 +1,118 @@
+import numpy as np
+
+
+class IVFIndex:
+    """inverted-file approximate index over the rows of a normalized matrix:
+    spherical k-means centroids, one row list per centroid, and a search that
+    only scores the rows in the nprobe closest lists"""
+
+    def __init__(self, nlist=None, nprobe=8, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self.ntotal = 0  # rows 0..ntotal-1 have been added
+        self.trained_size = 0
+
+    def train(self, vectors, iterations=10, max_samples_per_list=64):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(len(vectors))))
+        nlist = min(nlist, len(vectors))
+        rng = np.random.default_rng(self.seed)
+
+        # a sample is plenty to place the centroids
+        sample_size = min(len(vectors), nlist * max_samples_per_list)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+
+            # empty clusters keep their previous centroid
+            empty = norms[:, 0] == 0
+            sums[empty] = centroids[empty]
+            norms[empty] = 1
+            centroids = sums / norms
+
+        self.centroids = centroids
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+        self.ntotal = 0
+        self.trained_size = len(vectors)
+
+    @staticmethod
+    def _assign(vectors, centroids, batch_size=8192):
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        for i in range(0, len(vectors), batch_size):
+            scores = vectors[i : i + batch_size] @ centroids.T
+            assignments[i : i + batch_size] = scores.argmax(axis=1)
+        return assignments
+
+    def add(self, vectors):
+        # rows are numbered after the ones already added, no retraining
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+
+        assignments = self._assign(vectors, self.centroids)
+        rows = np.arange(self.ntotal, self.ntotal + len(vectors), dtype=np.int64)
+
+        order = np.argsort(assignments, kind="stable")
+        lists, starts = np.unique(assignments[order], return_index=True)
+        for list_id, group in zip(lists, np.split(rows[order], starts[1:])):
+            self.lists[list_id] = np.concatenate([self.lists[list_id], group])
+
+        self.ntotal += len(vectors)
+
+    def candidates(self, query, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        scores = self.centroids @ query
+        probe = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[list_id] for list_id in probe])
+
+    def search(self, query, matrix, top_k=5, nprobe=None, allowed=None):
+        """returns (rows, scores) of the best top_k rows of matrix"""
+        nprobe = nprobe or self.nprobe
+        while True:
+            rows = self.candidates(query, nprobe)
+            if allowed is not None:
+                rows = rows[allowed[rows]]
+
+            # filters can empty the probed lists, widen the probe if so
+            if len(rows) >= top_k or nprobe >= len(self.centroids):
+                break
+            nprobe *= 2
+
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+
+        scores = matrix[rows] @ query
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return rows[top], scores[top]
+
+    def save(self, path):
+        sizes = np.array([len(rows) for rows in self.lists], dtype=np.int64)
+        np.savez(
+            path,
+            centroids=self.centroids,
+            sizes=sizes,
+            rows=np.concatenate(self.lists) if self.lists else np.empty(0, np.int64),
+            meta=np.array([self.ntotal, self.trained_size, self.nprobe], dtype=np.int64),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        ntotal, trained_size, nprobe = data["meta"].tolist()
+
+        index = cls(nlist=len(data["centroids"]), nprobe=nprobe)
+        index.centroids = data["centroids"]
+        index.lists = np.split(data["rows"], np.cumsum(data["sizes"])[:-1])
+        index.ntotal = ntotal
+        index.trained_size = trained_size
+        return index
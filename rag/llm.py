@@ -1,55 +1,230 @@
+import logging
 import os
+import time
+import httpx
 import ollama
 from dotenv import load_dotenv
 
+from .metrics import LatencyStats
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# a model load longer than this means the call paid a cold start
+COLD_LOAD_SECONDS = 0.5
+
+
+def build_messages(prompt, context=None, system_prompt=None):
+    messages = []
+
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+
+    if context:
+        user_message = f"Context:\n{context}\n\nQuestion: {prompt}"
+    else:
+        user_message = prompt
+
+    messages.append({"role": "user", "content": user_message})
+
+    return messages
+
+
+class GenerationSettings:
+    """ollama options shared by every call, plus cold/warm latency stats"""
+
+    def __init__(self):
+        # the warm-up must use the same num_ctx, a different one reloads the model
+        self.num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+        # answers are meant to be one line, so cap runaway generations
+        self.max_tokens = int(os.getenv("OLLAMA_NUM_PREDICT", "256"))
+        self.stop = [stop for stop in os.getenv("OLLAMA_STOP", "").split("|") if stop]
+
+        # how long ollama keeps the model loaded after a call; -1 pins it
+        keep_alive = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+        self.keep_alive = int(keep_alive) if keep_alive.lstrip("-").isdigit() else keep_alive
+
+        # read by the api's startup, the only place that warms up; scripts
+        # that build a service just pay the load on their first call
+        self.warm_up = os.getenv("OLLAMA_WARMUP", "1") != "0"
+
+        self.latency = {
+            "cold": LatencyStats(),
+            "warm": LatencyStats(),
+            "model_load": LatencyStats(),
+        }
+
+    def options(self, max_tokens=None, num_ctx=None, stop=None):
+        options = {
+            "num_ctx": num_ctx or self.num_ctx,
+            "num_predict": max_tokens or self.max_tokens,
+        }
+        stop = self.stop if stop is None else stop
+        if stop:
+            options["stop"] = stop
+        return options
+
+    def record_load(self, response):
+        # load_duration is in nanoseconds, and only on the final response
+        load = (response.get("load_duration") or 0) / 1e9 if response else 0.0
+        if load > COLD_LOAD_SECONDS:
+            self.latency["model_load"].record(load)
+        return load
+
+    def record(self, seconds, response):
+        if self.record_load(response) > COLD_LOAD_SECONDS:
+            self.latency["cold"].record(seconds)
+        else:
+            self.latency["warm"].record(seconds)
+
+    def stats(self):
+        return {name: values.summary() for name, values in self.latency.items()}
+
 
 class LLMService:
     def __init__(self, model=None):
         self.model = model or os.getenv("OLLAMA_MODEL", "mistral")
+        self.settings = GenerationSettings()
         self._check_model()
 
     def _check_model(self):
         try:
             ollama.show(self.model)
         except ollama.ResponseError:
-            print(f"pulling {self.model}...")
+            logger.info("pulling %s", self.model)
             ollama.pull(self.model)
 
-    def generate(self, prompt, context=None, system_prompt=None):
+    def warm_up(self):
+        # load the model now so the first user query doesn't pay for it
+        start = time.perf_counter()
+        response = ollama.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": "hi"}],
+            options=self.settings.options(max_tokens=1),
+            keep_alive=self.settings.keep_alive,
+        )
+        self.settings.record_load(response)
+        logger.info("warmed up %s in %.1fs", self.model, time.perf_counter() - start)
+        return response
+
+    def generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
         # generate response using ollama
-        messages = []
+        messages = build_messages(prompt, context, system_prompt)
 
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+        start = time.perf_counter()
+        response = ollama.chat(
+            model=self.model,
+            messages=messages,
+            options=self.settings.options(max_tokens, num_ctx, stop),
+            keep_alive=self.settings.keep_alive,
+        )
+        self.settings.record(time.perf_counter() - start, response)
 
-        if context:
-            user_message = f"Context:\n{context}\n\nQuestion: {prompt}"
-        else:
-            user_message = prompt
+        return response["message"]["content"]
 
-        messages.append({"role": "user", "content": user_message})
+    def stream_generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
+        # generate streaming response using ollama
+        messages = build_messages(prompt, context, system_prompt)
+
+        start = time.perf_counter()
+        stream = ollama.chat(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            options=self.settings.options(max_tokens, num_ctx, stop),
+            keep_alive=self.settings.keep_alive,
+        )
+
+        chunk = None
+        for chunk in stream:
+            yield chunk["message"]["content"]
 
-        response = ollama.chat(model=self.model, messages=messages)
+        self.settings.record(time.perf_counter() - start, chunk)
 
-        return response["message"]["content"]
+    def stats(self):
+        return self.settings.stats()
 
-    def stream_generate(self, prompt, context=None, system_prompt=None):
-        # generate streaming response using ollama
-        messages = []
 
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+class AsyncLLMService:
+    """LLMService for the event loop, one pooled http client per process"""
 
-        if context:
-            user_message = f"Context:\n{context}\n\nQuestion: {prompt}"
-        else:
-            user_message = prompt
+    def __init__(self, model=None):
+        self.model = model or os.getenv("OLLAMA_MODEL", "mistral")
+        self.settings = GenerationSettings()
+        self.client = ollama.AsyncClient(
+            host=os.getenv("OLLAMA_HOST"),
+            limits=httpx.Limits(max_connections=int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))),
+        )
 
-        messages.append({"role": "user", "content": user_message})
+    async def check_model(self):
+        try:
+            await self.client.show(self.model)
+        except ollama.ResponseError:
+            logger.info("pulling %s", self.model)
+            await self.client.pull(self.model)
+
+    async def warm_up(self):
+        start = time.perf_counter()
+        response = await self.client.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": "hi"}],
+            options=self.settings.options(max_tokens=1),
+            keep_alive=self.settings.keep_alive,
+        )
+        self.settings.record_load(response)
+        logger.info("warmed up %s in %.1fs", self.model, time.perf_counter() - start)
+        return response
+
+    async def generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
+        messages = build_messages(prompt, context, system_prompt)
+
+        start = time.perf_counter()
+        response = await self.client.chat(
+            model=self.model,
+            messages=messages,
+            options=self.settings.options(max_tokens, num_ctx, stop),
+            keep_alive=self.settings.keep_alive,
+        )
+        self.settings.record(time.perf_counter() - start, response)
 
-        stream = ollama.chat(model=self.model, messages=messages, stream=True)
+        return response["message"]["content"]
 
-        for chunk in stream:
-            yield chunk["message"]["content"]
+    async def stream_generate(
+        self, prompt, context=None, system_prompt=None, max_tokens=None, num_ctx=None, stop=None
+    ):
+        messages = build_messages(prompt, context, system_prompt)
+
+        start = time.perf_counter()
+        stream = await self.client.chat(
+            model=self.model,
+            messages=messages,
+            stream=True,
+            options=self.settings.options(max_tokens, num_ctx, stop),
+            keep_alive=self.settings.keep_alive,
+        )
+
+        chunk = None
+        try:
+            async for chunk in stream:
+                yield chunk["message"]["content"]
+        finally:
+            # drops the http response, which makes ollama stop generating
+            await stream.aclose()
+
+        self.settings.record(time.perf_counter() - start, chunk)
+
+    def stats(self):
+        return self.settings.stats()
+
+    async def close(self):
+        # older ollama clients have no close()
+        close = getattr(self.client, "close", None)
+        if close is not None:
+            await close()
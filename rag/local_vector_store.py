@@ -0,0 +1,506 @@
+import json
+import os
+import shutil
+import uuid
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import numpy as np
+
+from .ivf_index import IVFIndex
+from .paths import cache_path
+from .quantization import QuantizationSettings, approximate_scores, quantize
+from .vector_store import bump_index_version, index_version
+
+load_dotenv()
+
+class LocalVectorStore:
+    """in-process replacement for VectorStore: cosine search over a
+    memory-mapped matrix of normalized vectors with a json payload sidecar.
+    search is exact by default, LOCAL_INDEX=ivf switches to an approximate
+    inverted-file index once the collection is large enough. with
+    QUANTIZATION set, exact search scans compact in-ram codes and rescores
+    the oversampled candidates against the memory-mapped floats.
+
+    every save writes a new generation directory (vectors, payloads, ivf,
+    codes) and then switches current.json to it in one rename, so a reader
+    in another process never pairs vectors with another save's payloads"""
+
+    def __init__(self, collection_name=None, store_dir=None):
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.store_dir = store_dir or cache_path(f"local_store/{self.collection_name}")
+        self.current_path = os.path.join(self.store_dir, "current.json")
+        self.dtype = np.dtype(os.getenv("LOCAL_VECTOR_DTYPE", "float32"))
+
+        self.index_type = os.getenv("LOCAL_INDEX", "exact")
+        self.ivf_nlist = int(os.getenv("IVF_NLIST", "0")) or None
+        self.ivf_nprobe = int(os.getenv("IVF_NPROBE", "8"))
+        # below this many rows exact search is already fast enough
+        self.ivf_min_rows = int(os.getenv("IVF_MIN_ROWS", "4096"))
+
+        self.quantization = QuantizationSettings()
+
+        # rows per write: bulk() spills its new vectors to disk in segments
+        # of this size, and saves copy the matrix through in blocks of it
+        self.segment_rows = int(os.getenv("LOCAL_SEGMENT_ROWS", "8192"))
+
+        # new vectors held back by bulk(), None outside it
+        self._pending = None
+        self._pending_deletes = False
+        self._spill_path = os.path.join(self.store_dir, "bulk.spill")
+        self._spilled = 0
+        self._bulk_dim = None
+
+        self._load()
+
+    def _generation_dir(self, generation):
+        return os.path.join(self.store_dir, f"gen-{generation:06d}")
+
+    def _generations(self):
+        if not os.path.isdir(self.store_dir):
+            return []
+        return sorted(
+            int(name[4:])
+            for name in os.listdir(self.store_dir)
+            if name.startswith("gen-") and name[4:].isdigit()
+        )
+
+    def _load(self):
+        self._loaded_version = index_version(self.collection_name)
+        # a writer in another process can switch generations between our
+        # reading current.json and opening its files; it keeps the previous
+        # generation around, so a retry finds a complete one
+        for attempt in range(3):
+            try:
+                self._load_generation()
+                return
+            except (FileNotFoundError, ValueError):
+                if attempt == 2:
+                    raise
+
+    def _load_generation(self):
+        self._generation = 0
+        self._vectors = None
+        self._ids = []
+        self._payloads = []
+        self._ivf = None
+        self._codes = None
+        self._scale = 1.0
+
+        directory = None
+        if os.path.exists(self.current_path):
+            with open(self.current_path, encoding="utf-8") as f:
+                self._generation = json.load(f)["generation"]
+            directory = self._generation_dir(self._generation)
+        elif os.path.exists(os.path.join(self.store_dir, "vectors.npy")):
+            # stores written before generations keep the same files directly
+            # in store_dir
+            directory = self.store_dir
+
+        if directory is not None:
+            # read-only map, pages are shared between processes
+            vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+            with open(os.path.join(directory, "payloads.json"), encoding="utf-8") as f:
+                sidecar = json.load(f)
+            if not len(vectors) == len(sidecar["ids"]) == len(sidecar["payloads"]):
+                raise ValueError(f"{directory}: vectors and payloads differ in length")
+            self._vectors = vectors
+            self._ids = sidecar["ids"]
+            self._payloads = sidecar["payloads"]
+
+            ivf_path = os.path.join(directory, "ivf.npz")
+            if self.index_type == "ivf" and os.path.exists(ivf_path):
+                self._ivf = IVFIndex.load(ivf_path)
+                self._ivf.nprobe = self.ivf_nprobe
+
+            if self.quantization.enabled:
+                self._load_codes(os.path.join(directory, "quantized.npz"))
+
+        self._build_masks()
+
+    def _load_codes(self, path):
+        if os.path.exists(path):
+            quantized = np.load(path)
+            if str(quantized["mode"]) == self.quantization.mode and len(
+                quantized["codes"]
+            ) == len(self._vectors):
+                self._codes = quantized["codes"]
+                self._scale = float(quantized["scale"])
+                return
+
+        # written without quantization or in another mode, quantize in memory
+        self._codes, self._scale = quantize(self._vectors, self.quantization.mode)
+
+    def _build_masks(self):
+        # deleted rows keep their slot (id None) until the next compaction
+        self._row_of = {
+            point_id: row for row, point_id in enumerate(self._ids) if point_id is not None
+        }
+        self._live_mask = np.array(
+            [point_id is not None for point_id in self._ids], dtype=bool
+        )
+        self._live_rows = np.flatnonzero(self._live_mask)
+        self._all_live = bool(self._live_mask.all())
+
+        self._source_masks = {}
+        for row in self._live_rows:
+            source = self._payloads[row].get("source")
+            if source not in self._source_masks:
+                self._source_masks[source] = np.zeros(len(self._ids), dtype=bool)
+            self._source_masks[source][row] = True
+        self._source_rows = {
+            source: np.flatnonzero(mask) for source, mask in self._source_masks.items()
+        }
+
+    def _save(self, parts):
+        """write the matrix made of parts (row blocks, in order) as a new
+        generation. rows are copied through block by block, so neither the
+        new vectors nor the whole matrix have to fit in memory"""
+        parts = [part for part in parts if part is not None]
+        dim = parts[0].shape[1]
+
+        # compact once deleted rows outnumber live ones
+        compacted = len(self._row_of) * 2 < len(self._ids)
+        keep = self._live_rows if compacted else None
+        if compacted:
+            self._ids = [self._ids[row] for row in keep]
+            self._payloads = [self._payloads[row] for row in keep]
+
+        # nothing reads a generation until current.json points at it
+        generation = max(self._generations() + [self._generation]) + 1
+        directory = self._generation_dir(generation)
+        os.makedirs(directory, exist_ok=True)
+
+        vectors_path = os.path.join(directory, "vectors.npy")
+        out = np.lib.format.open_memmap(
+            vectors_path, mode="w+", dtype=self.dtype, shape=(len(self._ids), dim)
+        )
+        offset = 0
+        written = 0
+        for part in parts:
+            for start in range(0, len(part), self.segment_rows):
+                block = part[start : start + self.segment_rows]
+                if keep is not None:
+                    lo, hi = offset + start, offset + start + len(block)
+                    block = block[
+                        keep[np.searchsorted(keep, lo) : np.searchsorted(keep, hi)] - lo
+                    ]
+                out[written : written + len(block)] = block
+                written += len(block)
+            offset += len(part)
+        out.flush()
+        del out
+        vectors = np.load(vectors_path, mmap_mode="r")
+
+        with open(os.path.join(directory, "payloads.json"), "w", encoding="utf-8") as f:
+            json.dump({"ids": self._ids, "payloads": self._payloads}, f)
+
+        if self.index_type == "ivf":
+            self._update_ivf(
+                np.asarray(vectors, dtype=np.float32),
+                os.path.join(directory, "ivf.npz"),
+                rebuild=compacted,
+            )
+
+        if self.quantization.enabled:
+            codes, scale = quantize(vectors, self.quantization.mode)
+            np.savez(
+                os.path.join(directory, "quantized.npz"),
+                codes=codes,
+                scale=scale,
+                mode=self.quantization.mode,
+            )
+
+        tmp_path = f"{self.current_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"generation": generation}, f)
+        os.replace(tmp_path, self.current_path)
+        self._remove_generations(keep=generation - 1)
+
+        bump_index_version(self.collection_name)
+        self._load()
+
+    def _remove_generations(self, keep=None):
+        # the generation before the current one stays for readers that
+        # picked it up just before the switch; open maps survive the unlink
+        for generation in self._generations():
+            if keep is None or generation < keep:
+                shutil.rmtree(self._generation_dir(generation), ignore_errors=True)
+        for name in ("vectors.npy", "payloads.json", "ivf.npz", "quantized.npz"):
+            path = os.path.join(self.store_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _update_ivf(self, vectors, path, rebuild):
+        ivf = self._ivf
+
+        # retrain after compaction (rows renumbered) or once the collection
+        # has outgrown the data the centroids were trained on
+        if (
+            rebuild
+            or ivf is None
+            or ivf.ntotal > len(vectors)
+            or len(vectors) > 4 * ivf.trained_size
+        ):
+            if len(vectors) < self.ivf_min_rows:
+                return
+
+            ivf = IVFIndex(nlist=self.ivf_nlist, nprobe=self.ivf_nprobe)
+            ivf.train(vectors)
+            ivf.add(vectors)
+        else:
+            # new rows go into the existing lists without a rebuild
+            ivf.add(vectors[ivf.ntotal :])
+
+        ivf.save(path)
+
+    def _tombstone(self, ids):
+        for point_id in ids:
+            row = self._row_of.pop(point_id, None)
+            if row is not None:
+                self._ids[row] = None
+                self._payloads[row] = None
+
+    def _refresh(self):
+        # pick up writes made by another process (e.g. ingest.py)
+        if index_version(self.collection_name) != self._loaded_version:
+            self._load()
+
+    def create_collection(self, vector_size=1024):
+        if self._vectors is not None:
+            print("collection already exists")
+            return
+
+        self._save([np.empty((0, vector_size), dtype=self.dtype)])
+        print(f"created local collection '{self.collection_name}'")
+
+    @contextmanager
+    def bulk(self):
+        """adds and deletes inside the block are written once, when it exits
+        cleanly, instead of rewriting the whole matrix (and ivf and codes)
+        per call. new vectors are spilled to disk every segment_rows rows, so
+        memory doesn't grow with the ingest. if the block raises, nothing is
+        written and the store goes back to its saved state. what the block
+        changes is not searchable until it exits"""
+        self._pending = []
+        self._pending_deletes = False
+        self._spilled = 0
+        self._bulk_dim = None
+        try:
+            yield self
+        except BaseException:
+            self._pending = None
+            # undo the in-memory ids and tombstones of the abandoned writes
+            self._load()
+            raise
+        else:
+            added = self._spilled + sum(len(vectors) for vectors in self._pending)
+            if added or self._pending_deletes:
+                parts = [self._vectors]
+                if self._spilled:
+                    parts.append(
+                        np.memmap(
+                            self._spill_path,
+                            dtype=self.dtype,
+                            mode="r",
+                            shape=(self._spilled, self._bulk_dim),
+                        )
+                    )
+                parts.extend(self._pending)
+                self._pending = None
+
+                self._build_masks()
+                self._save(parts)
+                print(f"wrote {added} new points to local store")
+        finally:
+            self._pending = None
+            self._spilled = 0
+            if os.path.exists(self._spill_path):
+                os.remove(self._spill_path)
+
+    def _spill(self):
+        # appends the held-back vectors to the spill file, in the store's dtype
+        os.makedirs(self.store_dir, exist_ok=True)
+        with open(self._spill_path, "ab") as f:
+            for vectors in self._pending:
+                f.write(np.ascontiguousarray(vectors, dtype=self.dtype).tobytes())
+                self._spilled += len(vectors)
+        self._pending = []
+
+    def add_documents(self, texts, embeddings, metadatas, ids=None):
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+
+        # upserting an existing id replaces its row
+        self._tombstone(ids)
+
+        start = len(self._ids)
+        self._ids.extend(ids)
+        self._payloads.extend(
+            {"text": text, **metadata} for text, metadata in zip(texts, metadatas)
+        )
+
+        if self._pending is not None:
+            # rows are numbered now, so a later upsert or delete in the same
+            # block finds them
+            for row, point_id in enumerate(ids, start):
+                self._row_of[point_id] = row
+            self._bulk_dim = vectors.shape[1]
+            self._pending.append(vectors)
+            if sum(len(vectors) for vectors in self._pending) >= self.segment_rows:
+                self._spill()
+            return
+
+        self._build_masks()
+        self._save([self._vectors, vectors])
+        print(f"uploaded {len(ids)} points to local store")
+
+    def delete_points(self, ids, source=None):
+        # ids this collection doesn't hold, e.g. another shard's, are skipped
+        ids = [point_id for point_id in ids if point_id in self._row_of]
+        if not ids:
+            return
+        self._tombstone(ids)
+        if self._pending is not None:
+            self._pending_deletes = True
+            return
+
+        self._build_masks()
+        self._save([self._vectors])
+        print(f"deleted {len(ids)} points")
+
+    def version(self):
+        return index_version(self.collection_name)
+
+    def search(self, query_embedding, top_k=5, source_filter=None):
+        return self.search_many([query_embedding], top_k, source_filter)[0]
+
+    def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        self._refresh()
+        if self._vectors is None or (
+            source_filter and source_filter not in self._source_masks
+        ):
+            return [[] for _ in query_embeddings]
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        if self._ivf is not None:
+            if source_filter:
+                allowed = self._source_masks[source_filter]
+            else:
+                allowed = None if self._all_live else self._live_mask
+            return [
+                self._to_results(
+                    *self._ivf.search(query, self._vectors, top_k, allowed=allowed)
+                )
+                for query in queries
+            ]
+
+        if source_filter:
+            rows = self._source_rows[source_filter]
+        elif self._all_live:
+            rows = None
+        else:
+            rows = self._live_rows
+
+        if self._codes is not None:
+            return self._search_quantized(queries, top_k, rows)
+
+        # one matmul for every query at once; a source filter picks its rows
+        # out of the scores rather than copying its vectors out of the memmap
+        scores = self._vectors @ queries.T
+        if rows is not None:
+            scores = scores[rows]
+
+        k = min(top_k, len(scores))
+        if k <= 0:
+            return [[] for _ in query_embeddings]
+
+        results = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top])]
+            results.append(
+                self._to_results(top if rows is None else rows[top], column[top])
+            )
+
+        return results
+
+    def _search_quantized(self, queries, top_k, rows):
+        codes = self._codes if rows is None else self._codes[rows]
+        k = min(top_k, len(codes))
+        if k <= 0:
+            return [[] for _ in queries]
+
+        approx = approximate_scores(
+            codes, self._scale, self.quantization.mode, queries, self._vectors.shape[1]
+        )
+        candidates = min(len(codes), max(k, int(k * self.quantization.oversampling)))
+
+        results = []
+        for query, column in zip(queries, approx):
+            top = np.argpartition(-column, candidates - 1)[:candidates]
+            top_rows = top if rows is None else rows[top]
+
+            if self.quantization.rescore:
+                # only the candidates' float rows are read from the memmap
+                order = np.argsort(top_rows)
+                top_rows = top_rows[order]
+                scores = np.asarray(self._vectors[top_rows], dtype=np.float32) @ query
+            else:
+                scores = column[top]
+
+            best = np.argsort(-scores)[:k]
+            results.append(self._to_results(top_rows[best], scores[best]))
+
+        return results
+
+    def _to_results(self, rows, scores):
+        results = []
+        for row, score in zip(rows, scores):
+            payload = self._payloads[row]
+            results.append(
+                {
+                    "id": self._ids[row],
+                    "text": payload.get("text", ""),
+                    "metadata": {
+                        key: value for key, value in payload.items() if key != "text"
+                    },
+                    "score": float(score),
+                }
+            )
+
+        return results
+
+    def delete_collection(self):
+        if os.path.exists(self.current_path):
+            os.remove(self.current_path)
+        self._remove_generations()
+        bump_index_version(self.collection_name)
+        self._load()
+        print("deleted collection")
+
+
+class AsyncLocalVectorStore:
+    """async facade over LocalVectorStore; searches are sub-millisecond and
+    cpu-bound, so they run inline instead of on a thread"""
+
+    def __init__(self, collection_name=None):
+        self.store = LocalVectorStore(collection_name=collection_name)
+
+    def version(self):
+        return self.store.version()
+
+    async def search(self, query_embedding, top_k=5, source_filter=None):
+        return self.store.search(query_embedding, top_k, source_filter)
+
+    async def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        return self.store.search_many(query_embeddings, top_k, source_filter)
+
+    async def close(self):
+        pass
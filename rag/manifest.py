@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import uuid
+
+from .paths import cache_path
+
+# fixed namespace so the same chunk always maps to the same point id
+POINT_ID_NAMESPACE = uuid.UUID("6f1c1a52-4d0e-4a39-9d43-2b7f3f3c8e51")
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_key(metadata):
+    # stable across machines, unlike the absolute file_path
+    return f"{metadata['source']}/{metadata['file_name']}"
+
+
+def chunk_point_id(key, position, text):
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{key}:{position}:{content_hash(text)}"))
+
+
+def default_manifest_name():
+    # one manifest per store, so switching backend or collection re-ingests
+    backend = os.getenv("VECTOR_BACKEND", "qdrant")
+    collection_name = os.getenv("COLLECTION_NAME", "tako_docs")
+    layout = ".sharded" if os.getenv("SHARD_BY_SOURCE", "0") == "1" else ""
+    return f"ingest_manifest.{backend}.{collection_name}{layout}.json"
+
+
+class IngestManifest:
+    """per-file content hashes and the point ids each file produced, and the
+    chunking settings it was produced with"""
+
+    def __init__(self, path=None, settings=None):
+        self.path = path or cache_path(os.getenv("INGEST_MANIFEST") or default_manifest_name())
+        # e.g. DocumentLoader.settings(): chunks depend on them as much as on the file
+        self.settings = content_hash(json.dumps(settings or {}, sort_keys=True))[:16]
+        self.files = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.files = json.load(f).get("files", {})
+
+    def is_unchanged(self, key, digest):
+        # a file chunked with other settings is re-chunked, and its old ids
+        # are kept until then so they can be deleted as stale
+        entry = self.files.get(key)
+        return (
+            entry is not None
+            and entry["hash"] == digest
+            and entry.get("settings") == self.settings
+        )
+
+    def point_ids(self, key):
+        return set(self.files.get(key, {}).get("ids", []))
+
+    def removed_keys(self, current_keys):
+        return [key for key in self.files if key not in current_keys]
+
+    def update(self, key, digest, ids):
+        self.files[key] = {"hash": digest, "settings": self.settings, "ids": list(ids)}
+
+    def remove(self, key):
+        self.files.pop(key, None)
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"files": self.files}, f)
+        os.replace(tmp_path, self.path)
+
+
+class DeadLetters:
+    """chunks whose embedding failed, kept so the next ingest run retries them"""
+
+    def __init__(self, path=None):
+        self.path = path or cache_path(
+            os.getenv("INGEST_DEAD_LETTERS", "dead_letters.json")
+        )
+        self.items = []
+
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self.items = json.load(f)
+
+    def save(self, items):
+        self.items = list(items)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.items, f)
+        os.replace(tmp_path, self.path)
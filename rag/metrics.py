@@ -0,0 +1,172 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# seconds, from a cache hit up to a slow cold generation
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "time spent per request stage", ["stage"], buckets=STAGE_BUCKETS
+)
+ERRORS = Counter("rag_errors_total", "errors by stage or kind, including swallowed ones", ["kind"])
+
+# the trace of the request being handled, if any
+_current_trace = ContextVar("rag_trace", default=None)
+
+
+class LatencyStats:
+    """rolling window of latency samples (seconds) with percentile summaries"""
+
+    def __init__(self, window=1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def summary(self):
+        with self._lock:
+            samples = sorted(self.samples)
+
+        if not samples:
+            return {"count": self.count}
+
+        def percentile(p):
+            return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+        return {
+            "count": self.count,
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99),
+            "max": samples[-1],
+        }
+
+
+class Trace:
+    """stage timings of one request, filled in by the spans run under it"""
+
+    def __init__(self):
+        self.spans = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage, seconds):
+        # a stage can run more than once, e.g. embed in hybrid retrieval
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+    def finish(self):
+        """record the request's total time, and return timings including it"""
+        seconds = time.perf_counter() - self.started
+        STAGE_SECONDS.labels("total").observe(seconds)
+        self.add("total", seconds)
+        return self.timings()
+
+    def timings(self):
+        """milliseconds per stage"""
+        return {stage: round(seconds * 1000, 3) for stage, seconds in self.spans.items()}
+
+
+@contextmanager
+def trace():
+    # spans inside this block, including ones in tasks started from it, land in the trace
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+def record_span(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    current = _current_trace.get()
+    if current is not None:
+        current.add(stage, seconds)
+
+
+@contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record_error(stage)
+        raise
+    finally:
+        record_span(stage, time.perf_counter() - start)
+
+
+def record_error(kind):
+    ERRORS.labels(kind).inc()
+
+
+class RAGCollector:
+    """exports counters the rag chain already keeps (cache hits, zero-vector
+    fallbacks, dead letters, cold/warm llm latency), read at scrape time"""
+
+    def __init__(self, rag):
+        self.rag = rag
+
+    def collect(self):
+        retriever = self.rag.retriever
+        embeddings = retriever.embeddings
+
+        hits = CounterMetricFamily(
+            "rag_cache_hits", "cache lookups that hit", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "rag_cache_misses", "cache lookups that missed", labels=["cache"]
+        )
+        caches = {
+            "query_embeddings": retriever.query_cache,
+            "search_results": retriever.results_cache,
+            "answers": self.rag.answer_cache,
+        }
+        if getattr(embeddings, "cache", None) is not None:
+            caches["embeddings"] = embeddings.cache
+        for name, cache in caches.items():
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+        yield hits
+        yield misses
+
+        yield CounterMetricFamily(
+            "rag_zero_vector_fallbacks",
+            "queries searched with a zero vector because embedding failed",
+            value=getattr(embeddings, "zero_vector_fallbacks", 0),
+        )
+        yield GaugeMetricFamily(
+            "rag_embedding_dead_letters",
+            "embedding batches that failed after retries in this process",
+            value=len(getattr(embeddings, "dead_letters", [])),
+        )
+
+        settings = getattr(self.rag.llm, "settings", None)
+        if settings is None:
+            return
+        calls = CounterMetricFamily(
+            "rag_llm_calls",
+            "llm calls that paid a model load (cold) or not (warm), and the loads",
+            labels=["kind"],
+        )
+        latency = GaugeMetricFamily(
+            "rag_llm_latency_seconds",
+            "llm latency percentiles over the recent window",
+            labels=["kind", "quantile"],
+        )
+        for kind, stats in settings.latency.items():
+            summary = stats.summary()
+            calls.add_metric([kind], summary["count"])
+            for quantile in ("p50", "p95", "p99", "max"):
+                if quantile in summary:
+                    latency.add_metric([kind, quantile], summary[quantile])
+        yield calls
+        yield latency
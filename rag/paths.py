@@ -0,0 +1,15 @@
+import os
+from pathlib import Path
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ROOT_DIR = Path(__file__).parent.parent
+
+# local state (manifests, caches, local indexes) lives here
+CACHE_DIR = Path(os.getenv("RAG_CACHE_DIR", ROOT_DIR / ".rag_cache"))
+
+
+def cache_path(name):
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    return CACHE_DIR / name
@@ -0,0 +1,115 @@
+import os
+from dotenv import load_dotenv
+import numpy as np
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    QuantizationSearchParams,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+)
+
+load_dotenv()
+
+MODES = ("none", "scalar", "binary")
+
+# int8 rows converted to float32 at a time; small enough that the
+# converted block is still in cache when it is multiplied
+BLOCK_ROWS = 256
+
+
+class QuantizationSettings:
+    """QUANTIZATION=none|scalar|binary for both backends. embeddings are
+    requested as floats and quantized by the store, so the originals are
+    always there to rescore the oversampled candidates"""
+
+    def __init__(self, mode=None):
+        self.mode = mode or os.getenv("QUANTIZATION", "none")
+        if self.mode not in MODES:
+            raise ValueError(f"QUANTIZATION must be one of {MODES}, got {self.mode!r}")
+
+        # binary codes are much coarser, so look at more candidates
+        default = "3.0" if self.mode == "binary" else "2.0"
+        self.oversampling = float(os.getenv("QUANTIZATION_OVERSAMPLING", default))
+        self.rescore = os.getenv("QUANTIZATION_RESCORE", "1") != "0"
+
+    @property
+    def enabled(self):
+        return self.mode != "none"
+
+    def qdrant_config(self):
+        # codes stay in ram, the float vectors can live on disk
+        if self.mode == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(
+                    type=ScalarType.INT8, quantile=0.99, always_ram=True
+                )
+            )
+        if self.mode == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def qdrant_search_params(self):
+        if not self.enabled:
+            return None
+        return SearchParams(
+            quantization=QuantizationSearchParams(
+                rescore=self.rescore, oversampling=self.oversampling
+            )
+        )
+
+
+def quantize(vectors, mode):
+    """codes plus the scale needed to turn int8 dot products back into cosines"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+
+    if mode == "scalar":
+        # clip the outer 1% like qdrant's quantile=0.99, estimated on ~1000 rows
+        sample = vectors[:: max(1, len(vectors) // 1000)]
+        scale = float(np.quantile(np.abs(sample), 0.99)) / 127 if len(sample) else 1.0
+        scale = scale or 1.0
+        codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+        return codes, scale
+
+    if mode == "binary":
+        return np.packbits(vectors > 0, axis=1), 1.0
+
+    raise ValueError(f"unknown quantization mode {mode!r}")
+
+
+def _popcount(bits):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    return _POPCOUNT_TABLE[bits]
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def approximate_scores(codes, scale, mode, queries, dim):
+    """(queries, rows) approximate cosine scores from the codes alone"""
+    queries = np.asarray(queries, dtype=np.float32)
+
+    if mode == "scalar":
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        buffer = np.empty((BLOCK_ROWS, codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), BLOCK_ROWS):
+            block = codes[start : start + BLOCK_ROWS]
+            np.copyto(buffer[: len(block)], block, casting="unsafe")
+            scores[:, start : start + len(block)] = (buffer[: len(block)] @ queries.T).T
+        return scores * scale
+
+    # hamming distance on sign bits, 8 bytes at a time where the width allows
+    query_bits = np.packbits(queries > 0, axis=1)
+    if codes.shape[1] % 8 == 0:
+        codes = codes.view(np.uint64)
+        query_bits = query_bits.view(np.uint64)
+
+    scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for i, bits in enumerate(query_bits):
+        distance = _popcount(np.bitwise_xor(codes, bits)).sum(axis=1, dtype=np.int32)
+        # matching sign bits as a cosine-like score in [-1, 1]
+        scores[i] = 1.0 - 2.0 * distance / dim
+    return scores
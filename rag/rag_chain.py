@@ -1,12 +1,21 @@
-from .retriever import Retriever
-from .llm import LLMService
+import asyncio
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
 
+from .answer_cache import AnswerCache
+from .context_builder import ContextBuilder
+from .retriever import AsyncRetriever, Retriever, normalize_query
+from .llm import AsyncLLMService, LLMService
+from .metrics import record_error, record_span, span, trace
+from .singleflight import AsyncSingleFlight, StreamBroadcast
 
-class RAGChain:
-    def __init__(self):
-        self.retriever = Retriever()
-        self.llm = LLMService()
-        self.system_prompt = """
+load_dotenv()
+
+SYSTEM_PROMPT = """
         CRITICAL: Give the SHORTEST possible answer.
 
             Rules:
@@ -28,26 +37,392 @@ class RAGChain:
             BE EXTREMELY BRIEF.
         """
 
+# env settings that change the answer to the same question
+ANSWER_SETTINGS = (
+    "VECTOR_BACKEND",
+    "SHARD_BY_SOURCE",
+    "COLLECTION_NAME",
+    "EMBEDDING_MODEL",
+    "CHUNKER",
+    "CHUNK_SIZE",
+    "CHUNK_OVERLAP",
+    "RETRIEVAL_MODE",
+    "LOCAL_INDEX",
+    "IVF_NPROBE",
+    "QUANTIZATION",
+    "QUANTIZATION_OVERSAMPLING",
+    "QUANTIZATION_RESCORE",
+    "CONTEXT_TOKEN_BUDGET",
+    "OLLAMA_MODEL",
+    "OLLAMA_NUM_CTX",
+    "OLLAMA_NUM_PREDICT",
+    "OLLAMA_STOP",
+)
+
+
+def timed_stream(tokens):
+    # time to first token and total generation, recorded as the tokens are read
+    start = time.perf_counter()
+    first = True
+    try:
+        for token in tokens:
+            if first:
+                record_span("first_token", time.perf_counter() - start)
+                first = False
+            yield token
+    except Exception:
+        record_error("generation")
+        raise
+    record_span("generation", time.perf_counter() - start)
+
+
+async def async_timed_stream(tokens):
+    start = time.perf_counter()
+    first = True
+    try:
+        async for token in tokens:
+            if first:
+                record_span("first_token", time.perf_counter() - start)
+                first = False
+            yield token
+    except Exception:
+        record_error("generation")
+        raise
+    finally:
+        # pass a close from the consumer on to the llm stream
+        await tokens.aclose()
+    record_span("generation", time.perf_counter() - start)
+
+
+def cached_stream(tokens, on_complete):
+    # an answer is only cached once the whole stream has been read
+    parts = []
+    for token in tokens:
+        parts.append(token)
+        yield token
+    on_complete("".join(parts))
+
+
+async def async_cached_stream(tokens, on_complete):
+    # on_complete is awaited, so it can move its disk writes off the loop
+    parts = []
+    try:
+        async for token in tokens:
+            parts.append(token)
+            yield token
+    finally:
+        await tokens.aclose()
+    await on_complete("".join(parts))
+
+
+async def async_slotted_stream(tokens, slots):
+    # holds a generation slot for as long as the llm stream runs
+    async with slots:
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            await tokens.aclose()
+
+
+async def replay(answer):
+    # a cached answer, served as a one-token stream
+    yield answer
+
+
+class RAGChain:
+    def __init__(self, retriever=None, llm=None):
+        self.retriever = retriever or Retriever()
+        self.llm = llm or LLMService()
+        self.context_builder = ContextBuilder()
+        self.system_prompt = SYSTEM_PROMPT
+        # near-duplicate questions reuse an earlier answer instead of ollama
+        self.answer_cache = AnswerCache()
+
+    def answer_version(self):
+        # cached answers are only valid for the index, prompt and settings
+        # they were generated with
+        config = {
+            "settings": {name: os.getenv(name, "") for name in ANSWER_SETTINGS},
+            "index_version": self.retriever.vector_store.version(),
+            "model": getattr(self.llm, "model", ""),
+            "system_prompt": self.system_prompt,
+            "token_budget": self.context_builder.token_budget,
+            "retrieval_mode": self.retriever.mode,
+        }
+        encoded = json.dumps(config, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def cached_result(self, cached, current, stream):
+        answer = cached["answer"]
+        return {
+            "answer": answer if not stream else iter([answer]),
+            "sources": cached["sources"],
+            "timings": current.finish(),
+            "cached": True,
+        }
+
+    def build_context(self, retrieved_docs):
+        # merged, deduplicated and cut to the token budget; the naive
+        # context is only measured, to report the tokens saved
+        with span("context"):
+            context, _ = self.context_builder.build(
+                retrieved_docs, naive_context=self.retriever.format_context(retrieved_docs)
+            )
+        return context
+
     def query(self, question, top_k=3, source_filter=None, stream=False):
-        # retrieve relevant documents
-        retrieved_docs = self.retriever.retrieve(
-            query=question, top_k=top_k, source_filter=source_filter
-        )
+        # timings holds milliseconds per stage of this request
+        with trace() as current:
+            # the query embedding is cached, so retrieval below reuses it
+            if self.answer_cache.enabled:
+                version = self.answer_version()
+                with span("embed"):
+                    query_embedding = self.retriever.embed_query(question)
+                cached = self.answer_cache.get(query_embedding, source_filter, top_k, version)
+                if cached is not None:
+                    return self.cached_result(cached, current, stream)
 
-        # format retrieved docs into context
-        context = self.retriever.format_context(retrieved_docs)
+            # retrieve relevant documents
+            retrieved_docs = self.retriever.retrieve(
+                query=question, top_k=top_k, source_filter=source_filter
+            )
 
-        # generate answer using llm
-        if stream:
-            return {
-                "answer": self.llm.stream_generate(
+            # fit retrieved docs into the context budget
+            context = self.build_context(retrieved_docs)
+
+            def remember(answer):
+                if self.answer_cache.enabled:
+                    self.answer_cache.put(
+                        query_embedding, question, source_filter, top_k, version,
+                        answer, retrieved_docs,
+                    )
+
+            # generate answer using llm
+            if stream:
+                # generation is timed as the caller reads it, so only the
+                # metrics see it, not timings
+                return {
+                    "answer": cached_stream(
+                        timed_stream(
+                            self.llm.stream_generate(
+                                prompt=question, context=context, system_prompt=self.system_prompt
+                            )
+                        ),
+                        remember,
+                    ),
+                    "sources": retrieved_docs,
+                    "timings": current.timings(),
+                    "cached": False,
+                }
+
+            with span("generation"):
+                answer = self.llm.generate(
                     prompt=question, context=context, system_prompt=self.system_prompt
-                ),
-                "sources": retrieved_docs,
-            }
+                )
+            remember(answer)
+
+        return {
+            "answer": answer,
+            "sources": retrieved_docs,
+            "timings": current.finish(),
+            "cached": False,
+        }
+
+    def query_batch(
+        self, questions, top_k=3, source_filter=None, max_concurrency=None, on_result=None
+    ):
+        # batched retrieval, then generation with bounded concurrency;
+        # on_result(i, result) is called from the worker as each one finishes
+        retrieved = self.retriever.retrieve_many(
+            questions, top_k=top_k, source_filter=source_filter
+        )
+        max_concurrency = max_concurrency or int(os.getenv("LLM_CONCURRENCY", "2"))
+
+        def answer(i):
+            context = self.build_context(retrieved[i])
+            try:
+                answer = self.llm.generate(
+                    prompt=questions[i], context=context, system_prompt=self.system_prompt
+                )
+            except Exception as e:
+                # one failed generation shouldn't lose the whole batch
+                result = {"answer": None, "sources": retrieved[i], "error": str(e)}
+            else:
+                result = {"answer": answer, "sources": retrieved[i]}
+
+            if on_result is not None:
+                on_result(i, result)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            return list(executor.map(answer, range(len(questions))))
+
+
+class AsyncRAGChain(RAGChain):
+    """RAGChain for the api: build once at startup, await start() and close()"""
+
+    def __init__(self, retriever=None, llm=None):
+        super().__init__(
+            retriever=retriever or AsyncRetriever(), llm=llm or AsyncLLMService()
+        )
+        self.generation_slots = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "2")))
+
+        # in-flight work keyed by (normalized question, top_k, source_filter)
+        self.inflight = AsyncSingleFlight()
+        self.streams = {}
+
+    async def start(self):
+        await self.llm.check_model()
+        if self.llm.settings.warm_up:
+            await self.llm.warm_up()
+
+    async def query(self, question, top_k=3, source_filter=None, stream=False):
+        # identical questions already in flight share one retrieval and one
+        # generation; streams are replayed to every caller from the start
+        key = (normalize_query(question), top_k, source_filter)
+
+        if not stream:
+            return await self.inflight.do(
+                key, lambda: self._answer(question, top_k, source_filter)
+            )
+
+        while True:
+            shared = self.streams.get(key)
+            if shared is None:
+                shared = await self.inflight.do(
+                    ("stream",) + key,
+                    lambda: self._start_stream(key, question, top_k, source_filter),
+                )
+
+            sources, broadcast, timings, cached = shared
+            # every earlier subscriber left while this caller waited for the
+            # stream to start, so it was stopped; start a new one
+            if not broadcast.cancelled:
+                break
+
+        return {
+            "answer": broadcast.subscribe(),
+            "sources": sources,
+            "timings": timings,
+            "cached": cached,
+        }
+
+    async def _lookup_answer(self, question, top_k, source_filter):
+        # (cached answer or None, query embedding, version), with the
+        # embedding left in the retriever's cache for the search
+        if not self.answer_cache.enabled:
+            return None, None, None
+
+        version = self.answer_version()
+        with span("embed"):
+            query_embedding = await self.retriever.embed_query(question)
+        cached = self.answer_cache.get(query_embedding, source_filter, top_k, version)
+        return cached, query_embedding, version
+
+    async def _answer(self, question, top_k, source_filter):
+        # coalesced callers share this result, timings included
+        with trace() as current:
+            cached, query_embedding, version = await self._lookup_answer(
+                question, top_k, source_filter
+            )
+            if cached is not None:
+                return self.cached_result(cached, current, stream=False)
+
+            retrieved_docs = await self.retriever.retrieve(
+                query=question, top_k=top_k, source_filter=source_filter
+            )
+
+            context = self.build_context(retrieved_docs)
+
+            with span("generation"):
+                async with self.generation_slots:
+                    answer = await self.llm.generate(
+                        prompt=question, context=context, system_prompt=self.system_prompt
+                    )
+
+        if self.answer_cache.enabled:
+            # a put can save the cache to disk; keep that off the event loop
+            await asyncio.to_thread(
+                self.answer_cache.put,
+                query_embedding, question, source_filter, top_k, version, answer, retrieved_docs,
+            )
+
+        return {
+            "answer": answer,
+            "sources": retrieved_docs,
+            "timings": current.finish(),
+            "cached": False,
+        }
+
+    async def _start_stream(self, key, question, top_k, source_filter):
+        with trace() as current:
+            cached, query_embedding, version = await self._lookup_answer(
+                question, top_k, source_filter
+            )
+
+            if cached is None:
+                retrieved_docs = await self.retriever.retrieve(
+                    query=question, top_k=top_k, source_filter=source_filter
+                )
+
+                context = self.build_context(retrieved_docs)
+
+        def finished():
+            if self.streams.get(key) is shared:
+                del self.streams[key]
+
+        async def remember(answer):
+            if self.answer_cache.enabled:
+                await asyncio.to_thread(
+                    self.answer_cache.put,
+                    query_embedding, question, source_filter, top_k, version,
+                    answer, retrieved_docs,
+                )
+
+        if cached is not None:
+            retrieved_docs = cached["sources"]
+            tokens = replay(cached["answer"])
         else:
-            answer = self.llm.generate(
-                prompt=question, context=context, system_prompt=self.system_prompt
+            tokens = async_cached_stream(
+                async_timed_stream(
+                    async_slotted_stream(
+                        self.llm.stream_generate(
+                            prompt=question, context=context, system_prompt=self.system_prompt
+                        ),
+                        self.generation_slots,
+                    )
+                ),
+                remember,
             )
 
-            return {"answer": answer, "sources": retrieved_docs}
+        broadcast = StreamBroadcast(tokens, on_finish=finished)
+        shared = (retrieved_docs, broadcast, current.timings(), cached is not None)
+        self.streams[key] = shared
+
+        return shared
+
+    async def query_batch(self, questions, top_k=3, source_filter=None):
+        retrieved = await self.retriever.retrieve_many(
+            questions, top_k=top_k, source_filter=source_filter
+        )
+
+        async def answer(question, sources):
+            context = self.build_context(sources)
+            try:
+                async with self.generation_slots:
+                    answer = await self.llm.generate(
+                        prompt=question, context=context, system_prompt=self.system_prompt
+                    )
+            except Exception as e:
+                return {"answer": None, "sources": sources, "error": str(e)}
+
+            return {"answer": answer, "sources": sources}
+
+        return await asyncio.gather(
+            *(answer(question, sources) for question, sources in zip(questions, retrieved))
+        )
+
+    async def close(self):
+        await self.retriever.close()
+        await self.llm.close()
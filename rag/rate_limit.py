@@ -0,0 +1,41 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """blocking token bucket that backs off on 429s and slowly recovers"""
+
+    def __init__(self, rate, capacity=None, min_rate=0.5):
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        # multiplicative decrease, and drain what's left so callers pause
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+
+    def on_success(self):
+        # additive increase back towards the configured rate
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
@@ -1,23 +1,166 @@
-from .embeddings import EmbeddingService
-from .vector_store import VectorStore
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+from .bm25 import BM25Index
+from .cache import TTLCache
+from .embeddings import AsyncEmbeddingService, EmbeddingService
+from .metrics import span
+from .vector_store import create_async_vector_store, create_vector_store
+
+load_dotenv()
+
+
+def normalize_query(query):
+    # "What is  the Vacation policy? " and "what is the vacation policy?" match
+    return " ".join(query.lower().split())
+
+
+def copy_results(results):
+    # callers (e.g. the context builder) may edit results, cached ones must stay intact
+    return [{**result, "metadata": dict(result["metadata"])} for result in results]
+
+
+def reciprocal_rank_fusion(result_lists, top_k, k=60):
+    # rank-based, so bm25 and cosine scores never need to be comparable
+    fused = {}
+    for results in result_lists:
+        for rank, result in enumerate(results):
+            entry = fused.setdefault(result["id"], [0.0, result])
+            entry[0] += 1.0 / (k + rank + 1)
+
+    ranked = sorted(fused.values(), key=lambda entry: entry[0], reverse=True)
+    return [{**result, "score": score} for score, result in ranked[:top_k]]
 
 
 class Retriever:
-    def __init__(self):
-        self.embeddings = EmbeddingService()
-        self.vector_store = VectorStore()
+    def __init__(self, embeddings=None, vector_store=None):
+        self.embeddings = embeddings or EmbeddingService()
+        self.vector_store = vector_store or create_vector_store()
+
+        # repeated questions skip both the cohere and the qdrant round trip
+        cache_size = int(os.getenv("RETRIEVER_CACHE_SIZE", "1024"))
+        cache_ttl = float(os.getenv("RETRIEVER_CACHE_TTL", "3600"))
+        self.query_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self.results_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+        self._index_version = None
+
+        # hybrid mode fuses bm25 with vector search, for exact command
+        # names and config keys that embeddings miss
+        self.mode = os.getenv("RETRIEVAL_MODE", "vector")
+        self.bm25 = None
+        if self.mode == "hybrid":
+            self.bm25 = BM25Index()
+            self._lexical_executor = ThreadPoolExecutor(max_workers=4)
+
+    def _check_index_version(self):
+        # re-ingesting bumps the stamp, which makes cached results stale
+        version = self.vector_store.version()
+        if version != self._index_version:
+            self.results_cache.clear()
+            self._index_version = version
+
+    def embed_query(self, query):
+        key = normalize_query(query)
+        query_embedding = self.query_cache.get(key)
+
+        if query_embedding is None:
+            query_embedding = self.embeddings.embed_query(query)
+            # a zero vector means the embedding call failed
+            if any(query_embedding):
+                self.query_cache.put(key, query_embedding)
+
+        return query_embedding
 
     # retrieve top 5 sources by default
     def retrieve(self, query, top_k=5, source_filter=None):
+        self._check_index_version()
+
+        if self.bm25 is None:
+            return self._vector_search(query, top_k, source_filter)
+
+        # run lexical search alongside the embed + vector search round trips
+        candidates = max(top_k * 4, 20)
+        lexical = self._lexical_executor.submit(
+            self.bm25.search, query, candidates, source_filter
+        )
+        dense = self._vector_search(query, candidates, source_filter)
+
+        return reciprocal_rank_fusion([dense, lexical.result()], top_k)
+
+    def _vector_search(self, query, top_k, source_filter):
         # get embedding for the query
-        query_embedding = self.embeddings.embed_query(query)
+        with span("embed"):
+            query_embedding = self.embed_query(query)
 
         # search for similar documents
-        results = self.vector_store.search(
-            query_embedding=query_embedding, top_k=top_k, source_filter=source_filter
+        with span("search"):
+            # keyed like the embedding cache, so two queries never share results
+            key = (normalize_query(query), top_k, source_filter)
+            results = self.results_cache.get(key)
+
+            if results is None:
+                results = self.vector_store.search(
+                    query_embedding=query_embedding, top_k=top_k, source_filter=source_filter
+                )
+                if any(query_embedding):
+                    self.results_cache.put(key, results)
+
+        return copy_results(results)
+
+    def retrieve_many(self, queries, top_k=5, source_filter=None):
+        # one embed call and one batch search for all queries
+        self._check_index_version()
+
+        if self.bm25 is None:
+            return self._vector_search_many(queries, top_k, source_filter)
+
+        candidates = max(top_k * 4, 20)
+        lexical = self._lexical_executor.map(
+            lambda query: self.bm25.search(query, candidates, source_filter), queries
         )
+        dense = self._vector_search_many(queries, candidates, source_filter)
+
+        return [
+            reciprocal_rank_fusion([dense_results, lexical_results], top_k)
+            for dense_results, lexical_results in zip(dense, lexical)
+        ]
 
-        return results
+    def _vector_search_many(self, queries, top_k, source_filter):
+        keys = [normalize_query(query) for query in queries]
+        query_embeddings = [self.query_cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(query_embeddings) if embedding is None]
+        if missing:
+            with span("embed"):
+                fresh = self.embeddings.embed_queries([queries[i] for i in missing])
+            for i, embedding in zip(missing, fresh):
+                query_embeddings[i] = embedding
+                if any(embedding):
+                    self.query_cache.put(keys[i], embedding)
+
+        result_keys = [(normalize_query(query), top_k, source_filter) for query in queries]
+        results = [self.results_cache.get(key) for key in result_keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            with span("search"):
+                fresh = self.vector_store.search_many(
+                    [query_embeddings[i] for i in missing], top_k=top_k, source_filter=source_filter
+                )
+            for i, result in zip(missing, fresh):
+                results[i] = result
+                if any(query_embeddings[i]):
+                    self.results_cache.put(result_keys[i], result)
+
+        return [copy_results(result) for result in results]
+
+    def cache_stats(self):
+        return {
+            "query_embeddings": self.query_cache.stats(),
+            "search_results": self.results_cache.stats(),
+        }
 
     def format_context(self, results):
         # format retrieved documents into context string
@@ -33,3 +176,88 @@ class Retriever:
             context_parts.append("")
 
         return "\n".join(context_parts)
+
+
+class AsyncRetriever(Retriever):
+    """Retriever for the event loop: same caches, async embedding and search"""
+
+    def __init__(self, embeddings=None, vector_store=None):
+        super().__init__(
+            embeddings=embeddings or AsyncEmbeddingService(),
+            vector_store=vector_store or create_async_vector_store(),
+        )
+
+    async def embed_query(self, query):
+        return (await self._embed_queries([query]))[0]
+
+    async def _embed_queries(self, queries):
+        keys = [normalize_query(query) for query in queries]
+        query_embeddings = [self.query_cache.get(key) for key in keys]
+
+        missing = [i for i, embedding in enumerate(query_embeddings) if embedding is None]
+        if missing:
+            fresh = await self.embeddings.embed_queries([queries[i] for i in missing])
+            for i, embedding in zip(missing, fresh):
+                query_embeddings[i] = embedding
+                if any(embedding):
+                    self.query_cache.put(keys[i], embedding)
+
+        return query_embeddings
+
+    async def retrieve(self, query, top_k=5, source_filter=None):
+        return (await self.retrieve_many([query], top_k, source_filter))[0]
+
+    async def retrieve_many(self, queries, top_k=5, source_filter=None):
+        self._check_index_version()
+
+        if self.bm25 is None:
+            return await self._vector_search_many(queries, top_k, source_filter)
+
+        # bm25 is cpu-bound, keep it off the event loop
+        candidates = max(top_k * 4, 20)
+        dense, lexical = await asyncio.gather(
+            self._vector_search_many(queries, candidates, source_filter),
+            asyncio.to_thread(
+                lambda: [self.bm25.search(query, candidates, source_filter) for query in queries]
+            ),
+        )
+
+        return [
+            reciprocal_rank_fusion([dense_results, lexical_results], top_k)
+            for dense_results, lexical_results in zip(dense, lexical)
+        ]
+
+    async def _vector_search_many(self, queries, top_k, source_filter):
+        with span("embed"):
+            query_embeddings = await self._embed_queries(queries)
+
+        result_keys = [(normalize_query(query), top_k, source_filter) for query in queries]
+        results = [self.results_cache.get(key) for key in result_keys]
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        with span("search"):
+            if len(missing) == 1:
+                fresh = [
+                    await self.vector_store.search(
+                        query_embeddings[missing[0]], top_k=top_k, source_filter=source_filter
+                    )
+                ]
+            elif missing:
+                fresh = await self.vector_store.search_many(
+                    [query_embeddings[i] for i in missing],
+                    top_k=top_k,
+                    source_filter=source_filter,
+                )
+            else:
+                fresh = []
+
+        for i, result in zip(missing, fresh):
+            results[i] = result
+            if any(query_embeddings[i]):
+                self.results_cache.put(result_keys[i], result)
+
+        return [copy_results(result) for result in results]
+
+    async def close(self):
+        await self.embeddings.close()
+        await self.vector_store.close()
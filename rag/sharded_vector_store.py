@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from dotenv import load_dotenv
+
+from .paths import cache_path
+
+load_dotenv()
+
+
+def shard_collection_name(collection_name, source):
+    return f"{collection_name}_{source}"
+
+
+def merge_results(result_lists, top_k):
+    # cosine scores from collections embedded by the same model are comparable
+    results = [result for results in result_lists for result in results]
+    return heapq.nlargest(top_k, results, key=lambda result: result["score"])
+
+
+class ShardRegistry:
+    """sources that have a shard, shared between the ingest and api processes"""
+
+    def __init__(self, collection_name):
+        self.path = cache_path(f"{collection_name}.shards.json")
+        self._mtime = None
+        self._sources = []
+
+    def sources(self):
+        # re-read only when another process has added a shard
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return []
+
+        if mtime != self._mtime:
+            with open(self.path, encoding="utf-8") as f:
+                self._sources = json.load(f)["sources"]
+            self._mtime = mtime
+        return list(self._sources)
+
+    def save(self, sources):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sources": sorted(sources)}, f)
+        os.replace(tmp_path, self.path)
+
+    def add(self, source):
+        sources = self.sources()
+        if source not in sources:
+            self.save(sources + [source])
+
+
+class ShardedVectorStore:
+    """one collection per source behind the VectorStore interface. a filtered
+    search touches only its source's shard, an unfiltered one fans out to
+    every shard in parallel and merges the top k, and a source can be
+    rebuilt without touching the others"""
+
+    def __init__(self, make_shard, collection_name=None):
+        # make_shard(collection_name) -> VectorStore or LocalVectorStore
+        self.make_shard = make_shard
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.registry = ShardRegistry(self.collection_name)
+        self.vector_size = 1024
+        self._shards = {}
+        self._executor = ThreadPoolExecutor(max_workers=int(os.getenv("SHARD_WORKERS", "8")))
+        # set while inside bulk(), so shards created then join it
+        self._bulk = None
+
+    def shard(self, source):
+        if source not in self._shards:
+            shard = self.make_shard(shard_collection_name(self.collection_name, source))
+            if self._bulk is not None and hasattr(shard, "bulk"):
+                self._bulk.enter_context(shard.bulk())
+            self._shards[source] = shard
+        return self._shards[source]
+
+    def sources(self):
+        return self.registry.sources()
+
+    @contextmanager
+    def bulk(self):
+        """bulk() on every shard that has it, e.g. the local backend"""
+        with ExitStack() as stack:
+            self._bulk = stack
+            try:
+                for shard in self._shards.values():
+                    if hasattr(shard, "bulk"):
+                        stack.enter_context(shard.bulk())
+                yield self
+            finally:
+                self._bulk = None
+
+    def create_collection(self, vector_size=1024):
+        # shards for new sources are created as their first chunks arrive
+        self.vector_size = vector_size
+        for source in self.sources():
+            self.shard(source).create_collection(vector_size)
+
+    def add_documents(self, texts, embeddings, metadatas, ids=None):
+        by_source = defaultdict(list)
+        for i, metadata in enumerate(metadatas):
+            by_source[metadata.get("source", "unknown")].append(i)
+
+        for source, rows in by_source.items():
+            if source not in self.sources():
+                self.shard(source).create_collection(self.vector_size)
+                self.registry.add(source)
+
+            self.shard(source).add_documents(
+                [texts[i] for i in rows],
+                [embeddings[i] for i in rows],
+                [metadatas[i] for i in rows],
+                ids=[ids[i] for i in rows] if ids is not None else None,
+            )
+
+    def delete_points(self, ids, source=None):
+        # ids don't say which source they came from; without the hint every
+        # shard is asked to drop its own
+        ids = list(ids)
+        if source is not None:
+            if source in self.sources():
+                self.shard(source).delete_points(ids)
+            return
+
+        shards = [self.shard(source) for source in self.sources()]
+        list(self._executor.map(lambda shard: shard.delete_points(ids), shards))
+
+    def rebuild_shard(self, source):
+        """empty one source's shard, for a full re-ingest of just that source"""
+        shard = self.shard(source)
+        shard.delete_collection()
+        shard.create_collection(self.vector_size)
+        self.registry.add(source)
+
+    def version(self):
+        # any shard written to, or a new shard, changes the combined stamp
+        return "|".join(
+            f"{source}:{self.shard(source).version()}" for source in self.sources()
+        )
+
+    def search(self, query_embedding, top_k=5, source_filter=None):
+        return self.search_many([query_embedding], top_k, source_filter)[0]
+
+    def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        if source_filter:
+            if source_filter not in self.sources():
+                return [[] for _ in query_embeddings]
+            # every point in the shard matches, so no payload filter needed
+            return self.shard(source_filter).search_many(query_embeddings, top_k)
+
+        # shards are looked up here, not on the worker threads
+        shards = [self.shard(source) for source in self.sources()]
+        per_shard = list(
+            self._executor.map(lambda shard: shard.search_many(query_embeddings, top_k), shards)
+        )
+        return [
+            merge_results([results[i] for results in per_shard], top_k)
+            for i in range(len(query_embeddings))
+        ]
+
+    def delete_collection(self):
+        for source in self.sources():
+            self.shard(source).delete_collection()
+        self.registry.save([])
+
+
+class AsyncShardedVectorStore:
+    """read side of ShardedVectorStore, fanning out with asyncio.gather"""
+
+    def __init__(self, make_shard, collection_name=None, close=None):
+        self.make_shard = make_shard
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.registry = ShardRegistry(self.collection_name)
+        self._shards = {}
+        # shards may share one client, closed once here instead of per shard
+        self._close = close
+
+    def shard(self, source):
+        if source not in self._shards:
+            self._shards[source] = self.make_shard(
+                shard_collection_name(self.collection_name, source)
+            )
+        return self._shards[source]
+
+    def version(self):
+        return "|".join(
+            f"{source}:{self.shard(source).version()}" for source in self.registry.sources()
+        )
+
+    async def search(self, query_embedding, top_k=5, source_filter=None):
+        return (await self.search_many([query_embedding], top_k, source_filter))[0]
+
+    async def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        sources = self.registry.sources()
+        if source_filter:
+            if source_filter not in sources:
+                return [[] for _ in query_embeddings]
+            return await self.shard(source_filter).search_many(query_embeddings, top_k)
+
+        per_shard = await asyncio.gather(
+            *(self.shard(source).search_many(query_embeddings, top_k) for source in sources)
+        )
+        return [
+            merge_results([results[i] for results in per_shard], top_k)
+            for i in range(len(query_embeddings))
+        ]
+
+    async def close(self):
+        if self._close is not None:
+            await self._close()
+            return
+        for shard in self._shards.values():
+            await shard.close()
@@ -0,0 +1,130 @@
+import asyncio
+
+
+class AsyncSingleFlight:
+    """callers asking for a key that is already being computed await the
+    same task instead of starting their own"""
+
+    def __init__(self):
+        self._tasks = {}
+
+    def in_flight(self):
+        return len(self._tasks)
+
+    async def do(self, key, fn):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        # shielded, so one caller going away doesn't cancel it for the rest
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+class StreamCancelled(RuntimeError):
+    """every subscriber left, so the shared stream was stopped part way"""
+
+
+class StreamBroadcast:
+    """runs one async token stream and replays it to every subscriber,
+    including ones that join late. the stream is cancelled once the last
+    subscriber leaves before it finishes"""
+
+    def __init__(self, stream, on_finish=None):
+        self.tokens = []
+        self.done = False
+        self.error = None
+        # subscriptions handed out and not yet closed, whether or not they
+        # have started reading
+        self.subscribers = 0
+        self._on_finish = on_finish
+        self._changed = asyncio.Condition()
+        self._task = asyncio.ensure_future(self._pump(stream))
+
+    @property
+    def cancelled(self):
+        return isinstance(self.error, StreamCancelled)
+
+    async def _pump(self, stream):
+        try:
+            async for token in stream:
+                self.tokens.append(token)
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            await stream.aclose()
+            self.done = True
+            self._finish()
+            async with self._changed:
+                self._changed.notify_all()
+
+    def _finish(self):
+        if self._on_finish is not None:
+            self._on_finish()
+            self._on_finish = None
+
+    def subscribe(self):
+        # counted now, not when iteration starts, so a caller that got the
+        # broadcast but hasn't read yet keeps it alive
+        self.subscribers += 1
+        return _Subscription(self)
+
+    def _leave(self):
+        self.subscribers -= 1
+        if self.subscribers == 0 and not self.done:
+            # nobody is listening, stop generating. anyone still holding this
+            # broadcast sees an error rather than a truncated answer, and it
+            # is dropped first so new askers start over
+            self.error = StreamCancelled("stream cancelled after every subscriber left")
+            self._finish()
+            self._task.cancel()
+
+
+class _Subscription:
+    """one subscriber's read position in a StreamBroadcast"""
+
+    def __init__(self, broadcast):
+        self.broadcast = broadcast
+        self.position = 0
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        broadcast = self.broadcast
+
+        while True:
+            if self.closed:
+                raise StopAsyncIteration
+
+            if self.position < len(broadcast.tokens):
+                self.position += 1
+                return broadcast.tokens[self.position - 1]
+
+            if broadcast.done:
+                await self.aclose()
+                if broadcast.error is not None:
+                    raise broadcast.error
+                raise StopAsyncIteration
+
+            try:
+                async with broadcast._changed:
+                    await broadcast._changed.wait_for(
+                        lambda: self.position < len(broadcast.tokens) or broadcast.done
+                    )
+            except BaseException:
+                await self.aclose()
+                raise
+
+    async def aclose(self):
+        if not self.closed:
+            self.closed = True
+            self.broadcast._leave()
@@ -1,22 +1,170 @@
 import os
+import random
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from qdrant_client.models import (
-    Distance, VectorParams, PointStruct,
+    Distance, VectorParams, PointStruct, PointIdsList, QueryRequest,
     Filter, FieldCondition, MatchValue, PayloadSchemaType
 )
 
+from .chunk_store import ChunkStore
+from .metrics import record_error
+from .paths import cache_path
+from .quantization import QuantizationSettings
+
 load_dotenv()
 
+# the only payload fields a lean collection keeps, for filtering
+LEAN_PAYLOAD_FIELDS = ("source", "Header_1", "Header_2", "Header_3")
 
-class VectorStore:
-    def __init__(self):
-        self.client = QdrantClient(
-            url=os.getenv("QDRANT_URL"),
-            api_key=os.getenv("QDRANT_API_KEY"),
+
+def index_version(collection_name):
+    # stamp changes whenever the collection is written to
+    try:
+        return cache_path(f"{collection_name}.version").read_text()
+    except FileNotFoundError:
+        return ""
+
+
+def bump_index_version(collection_name):
+    cache_path(f"{collection_name}.version").write_text(uuid.uuid4().hex)
+
+
+def source_condition(source_filter):
+    if not source_filter:
+        return None
+
+    return Filter(
+        must=[
+            FieldCondition(
+                key="source",
+                match=MatchValue(value=source_filter)
+            )
+        ]
+    )
+
+
+def hits_to_results(hits, chunk_store=None):
+    # lean collections keep text and full metadata in the local chunk store;
+    # points written before the switch still carry them in the payload
+    records = [None] * len(hits)
+    if chunk_store is not None:
+        records = chunk_store.get_many([str(hit.id) for hit in hits])
+
+    results = []
+    for hit, record in zip(hits, records):
+        if record is None:
+            text = hit.payload.get("text", "")
+            metadata = {k: v for k, v in hit.payload.items() if k != "text"}
+        else:
+            text, metadata = record
+
+        results.append(
+            {
+                "id": str(hit.id),
+                "text": text,
+                "metadata": metadata,
+                "score": hit.score
+            }
         )
-        self.collection_name = os.getenv("COLLECTION_NAME", "tako_docs")
+
+    return results
+
+
+def lean_payloads():
+    return os.getenv("LEAN_PAYLOAD", "0") == "1"
+
+
+def qdrant_client_options():
+    # QDRANT_PATH (or QDRANT_URL=:memory:) runs qdrant in-process, no server
+    if os.getenv("QDRANT_PATH"):
+        return {"path": os.getenv("QDRANT_PATH")}
+    if os.getenv("QDRANT_URL") == ":memory:":
+        return {"location": ":memory:"}
+
+    # grpc is much cheaper than json over http for bulk vector uploads
+    return {
+        "url": os.getenv("QDRANT_URL"),
+        "api_key": os.getenv("QDRANT_API_KEY"),
+        "prefer_grpc": os.getenv("QDRANT_PREFER_GRPC", "0") == "1",
+        "grpc_port": int(os.getenv("QDRANT_GRPC_PORT", "6334")),
+    }
+
+
+def qdrant_in_process(options):
+    return "path" in options or options.get("location") == ":memory:"
+
+
+def sharded_by_source():
+    return os.getenv("SHARD_BY_SOURCE", "0") == "1"
+
+
+def create_vector_store():
+    # VECTOR_BACKEND=local keeps everything in-process, no qdrant needed
+    if os.getenv("VECTOR_BACKEND", "qdrant") == "local":
+        from .local_vector_store import LocalVectorStore
+
+        make_store = LocalVectorStore
+    else:
+        options = qdrant_client_options()
+        client = QdrantClient(**options)
+
+        def make_store(collection_name=None):
+            return VectorStore(
+                client=client,
+                collection_name=collection_name,
+                in_process=qdrant_in_process(options),
+            )
+
+    # SHARD_BY_SOURCE=1 gives every source its own collection
+    if sharded_by_source():
+        from .sharded_vector_store import ShardedVectorStore
+
+        return ShardedVectorStore(make_store)
+    return make_store()
+
+
+def create_async_vector_store():
+    if os.getenv("VECTOR_BACKEND", "qdrant") == "local":
+        from .local_vector_store import AsyncLocalVectorStore
+
+        make_store, close = AsyncLocalVectorStore, None
+    else:
+        client = AsyncQdrantClient(**qdrant_client_options())
+
+        def make_store(collection_name=None):
+            return AsyncVectorStore(client=client, collection_name=collection_name)
+
+        close = client.close
+
+    if sharded_by_source():
+        from .sharded_vector_store import AsyncShardedVectorStore
+
+        return AsyncShardedVectorStore(make_store, close=close)
+    return make_store()
+
+
+class VectorStore:
+    def __init__(self, client=None, collection_name=None, in_process=False):
+        # a client can be passed in, e.g. QdrantClient(":memory:") for
+        # benchmarks, along with whether it runs qdrant in-process
+        if client is None:
+            options = qdrant_client_options()
+            client = QdrantClient(**options)
+            in_process = qdrant_in_process(options)
+        self.client = client
+        self.in_process = in_process
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.chunk_store = ChunkStore(self.collection_name) if lean_payloads() else None
+        self.quantization = QuantizationSettings()
+
+        # bulk upload: parallel unacknowledged batches, then one barrier
+        self.upload_batch_size = int(os.getenv("UPLOAD_BATCH_SIZE", "256"))
+        self.upload_workers = int(os.getenv("UPLOAD_WORKERS", "4"))
+        self.upload_max_retries = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
     
     def create_collection(self, vector_size=1024):
         try:
@@ -24,80 +172,221 @@ class VectorStore:
                 collection_name=self.collection_name,
                 vectors_config=VectorParams(
                     size=vector_size,
-                    distance=Distance.COSINE
-                )
+                    distance=Distance.COSINE,
+                    # quantized codes stay in ram, floats are only read to rescore
+                    on_disk=self.quantization.enabled
+                ),
+                quantization_config=self.quantization.qdrant_config()
             )
             self.client.create_payload_index(
                 collection_name=self.collection_name,
                 field_name="source",
                 field_schema=PayloadSchemaType.KEYWORD
             )
+            bump_index_version(self.collection_name)
             print(f"created collection '{self.collection_name}' with index")
             
         except Exception as e:
             if "already exists" in str(e):
                 print(f"collection already exists")
+                if self.quantization.enabled:
+                    # qdrant builds the codes for existing points in the background
+                    self.client.update_collection(
+                        collection_name=self.collection_name,
+                        quantization_config=self.quantization.qdrant_config()
+                    )
             else:
                 raise e
     
-    def add_documents(self, texts, embeddings, metadatas):
-        points = []
+    def add_documents(self, texts, embeddings, metadatas, ids=None):
+        # deterministic ids make re-ingestion an upsert instead of a duplicate
+        if ids is None:
+            ids = [str(uuid.uuid4()) for _ in texts]
         
-        for text, embedding, metadata in zip(texts, embeddings, metadatas):
-            point_id = str(uuid.uuid4())
-            
-            payload = {
-                "text": text,
-                **metadata
-            }
-            
-            points.append(
-                PointStruct(
-                    id=point_id,
-                    vector=embedding,
-                    payload=payload
+        if self.chunk_store is not None:
+            self.chunk_store.put_many(ids, texts, metadatas)
+            self.chunk_store.save()
+        
+        def build_points(start):
+            # built per batch, so only the batches in flight exist as PointStructs
+            points = []
+            end = start + self.upload_batch_size
+            for point_id, text, embedding, metadata in zip(
+                ids[start:end], texts[start:end], embeddings[start:end], metadatas[start:end]
+            ):
+                if self.chunk_store is not None:
+                    payload = {k: metadata[k] for k in LEAN_PAYLOAD_FIELDS if k in metadata}
+                else:
+                    payload = {
+                        "text": text,
+                        **metadata
+                    }
+                
+                points.append(
+                    PointStruct(
+                        id=point_id,
+                        vector=embedding,
+                        payload=payload
+                    )
                 )
-            )
+            return points
+        
+        def upload(start):
+            points = build_points(start)
+            self._upsert_with_retries(points, wait=False)
+            return len(points)
+        
+        began = time.perf_counter()
+        starts = range(0, len(ids), self.upload_batch_size)
+        failed = []
         
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            self.client.upsert(
+        # the in-process local mode is not safe for concurrent writes
+        workers = 1 if self.in_process else self.upload_workers
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            futures = {executor.submit(upload, start): start for start in starts}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"error: upload batch at {futures[future]} failed after retries: {e}")
+                    record_error("upload_batch")
+                    failed.append(futures[future])
+        
+        if failed:
+            raise RuntimeError(f"{len(failed)} of {len(starts)} upload batches failed")
+        
+        # updates are applied in order, so once a final acknowledged write is
+        # applied every batch before it is searchable too
+        if len(starts):
+            self._upsert_with_retries(build_points(starts[-1]), wait=True)
+        
+        elapsed = time.perf_counter() - began
+        print(f"uploaded {len(ids)} points in {elapsed:.1f}s ({len(starts)} batches)")
+        
+        bump_index_version(self.collection_name)
+    
+    def _upsert_with_retries(self, points, wait):
+        # only this batch is retried, the others carry on in parallel
+        for attempt in range(self.upload_max_retries + 1):
+            try:
+                return self.client.upsert(
+                    collection_name=self.collection_name,
+                    points=points,
+                    wait=wait
+                )
+            except Exception:
+                if attempt == self.upload_max_retries:
+                    raise
+                time.sleep(min(10.0, 0.5 * 2**attempt) * (0.5 + random.random()))
+    
+    def delete_points(self, ids, source=None):
+        # source only matters to a sharded store, one collection holds every source
+        ids = list(ids)
+        batch_size = 1000
+        for i in range(0, len(ids), batch_size):
+            self.client.delete(
                 collection_name=self.collection_name,
-                points=batch
+                points_selector=PointIdsList(points=ids[i:i + batch_size])
             )
-            print(f"uploaded {min(i + batch_size, len(points))}/{len(points)}")
+        if self.chunk_store is not None:
+            self.chunk_store.delete(ids)
+            self.chunk_store.save()
+        bump_index_version(self.collection_name)
+        print(f"deleted {len(ids)} points")
+    
+    def version(self):
+        return index_version(self.collection_name)
     
     def search(self, query_embedding, top_k=5, source_filter=None):
         
         search_params = {
             "collection_name": self.collection_name,
-            "query_vector": query_embedding,
+            "query": query_embedding,
             "limit": top_k,
             "with_payload": True,
+            "search_params": self.quantization.qdrant_search_params(),
         }
         
         if source_filter:
-            search_params["query_filter"] = Filter(
-                must=[
-                    FieldCondition(
-                        key="source",
-                        match=MatchValue(value=source_filter)
-                    )
-                ]
-            )
+            search_params["query_filter"] = source_condition(source_filter)
         
-        results = self.client.search(**search_params)
+        results = self.client.query_points(**search_params)
         
-        return [
-            {
-                "text": hit.payload.get("text", ""),
-                "metadata": {k: v for k, v in hit.payload.items() if k != "text"},
-                "score": hit.score
-            }
-            for hit in results
+        return hits_to_results(results.points, self.chunk_store)
+    
+    def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        # one round trip for all queries
+        requests = [
+            QueryRequest(
+                query=query_embedding,
+                limit=top_k,
+                with_payload=True,
+                filter=source_condition(source_filter),
+                params=self.quantization.qdrant_search_params()
+            )
+            for query_embedding in query_embeddings
         ]
+        
+        batches = self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        
+        return [hits_to_results(batch.points, self.chunk_store) for batch in batches]
     
     def delete_collection(self):
         self.client.delete_collection(collection_name=self.collection_name)
-        print(f"deleted collection")
\ No newline at end of file
+        if self.chunk_store is not None:
+            self.chunk_store.clear()
+            self.chunk_store.save()
+        bump_index_version(self.collection_name)
+        print(f"deleted collection")
+
+
+class AsyncVectorStore:
+    """read side of VectorStore on an async qdrant client"""
+
+    def __init__(self, client=None, collection_name=None):
+        self.client = client or AsyncQdrantClient(**qdrant_client_options())
+        self.collection_name = collection_name or os.getenv("COLLECTION_NAME", "tako_docs")
+        self.chunk_store = ChunkStore(self.collection_name) if lean_payloads() else None
+        self.quantization = QuantizationSettings()
+    
+    def version(self):
+        return index_version(self.collection_name)
+    
+    async def search(self, query_embedding, top_k=5, source_filter=None):
+        results = await self.client.query_points(
+            collection_name=self.collection_name,
+            query=query_embedding,
+            limit=top_k,
+            with_payload=True,
+            query_filter=source_condition(source_filter),
+            search_params=self.quantization.qdrant_search_params()
+        )
+        
+        # local mmap reads, cheap enough to do on the event loop
+        return hits_to_results(results.points, self.chunk_store)
+    
+    async def search_many(self, query_embeddings, top_k=5, source_filter=None):
+        requests = [
+            QueryRequest(
+                query=query_embedding,
+                limit=top_k,
+                with_payload=True,
+                filter=source_condition(source_filter),
+                params=self.quantization.qdrant_search_params()
+            )
+            for query_embedding in query_embeddings
+        ]
+        
+        batches = await self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=requests
+        )
+        
+        return [hits_to_results(batch.points, self.chunk_store) for batch in batches]
+    
+    async def close(self):
+        await self.client.close()
@@ -0,0 +1,216 @@
+"""the github collector against canned api responses: conditional tree
+listings (etag / 304) and the manifest diff between runs.
+
+run with: python -m unittest discover tests"""
+
+import base64
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from data import data as collector
+
+REPO = "example/handbook"
+CONFIG = {"repo": REPO, "paths": ["docs/"]}
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def json(self):
+        return self.body
+
+
+class FakeGitHub:
+    """requests.Session stand-in serving one repo's tree and blobs"""
+
+    def __init__(self):
+        self.headers = {}
+        self.files = {}  # path -> content
+        self.etag = None
+        self.version = 0
+        self.failing = set()  # blob shas that return 404
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def set_files(self, files):
+        self.files = dict(files)
+        self.version += 1
+        self.etag = f'"tree-{self.version}"'
+
+    @staticmethod
+    def sha(content):
+        return f"sha-{content}"
+
+    def get(self, url, headers=None, timeout=None):
+        path = url.removeprefix("https://github.test")
+        with self._lock:
+            self.requests.append((path, dict(headers or {})))
+
+        if path == f"/repos/{REPO}/git/trees/HEAD?recursive=1":
+            if headers and headers.get("If-None-Match") == self.etag:
+                return FakeResponse(304)
+            tree = [
+                {"path": path, "type": "blob", "sha": self.sha(content)}
+                for path, content in self.files.items()
+            ]
+            tree.append({"path": "docs", "type": "tree", "sha": "sha-docs"})
+            return FakeResponse(200, {"tree": tree, "truncated": False}, {"ETag": self.etag})
+
+        prefix = f"/repos/{REPO}/git/blobs/"
+        if path.startswith(prefix):
+            sha = path[len(prefix) :]
+            for content in self.files.values():
+                if self.sha(content) == sha and sha not in self.failing:
+                    encoded = base64.b64encode(content.encode("utf-8")).decode("ascii")
+                    return FakeResponse(200, {"content": encoded, "encoding": "base64"})
+            return FakeResponse(404)
+
+        return FakeResponse(404)
+
+    def blob_requests(self):
+        return [path for path, _ in self.requests if "/git/blobs/" in path]
+
+
+class CollectorTest(unittest.TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp(prefix="collector_test_")
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self._output_dir = collector.OUTPUT_DIR
+        collector.OUTPUT_DIR = self.output_dir
+        self.addCleanup(setattr, collector, "OUTPUT_DIR", self._output_dir)
+
+        self.github = FakeGitHub()
+        self.client = collector.GitHubClient(
+            api_url="https://github.test/", token="", workers=2, rate=1000, session=self.github
+        )
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.executor.shutdown)
+
+    def collect(self, previous):
+        return collector.collect_source(self.client, self.executor, "handbook", CONFIG, previous)
+
+    def local(self, name):
+        return os.path.join(self.output_dir, "handbook", name)
+
+    def test_reads_no_environment_at_import(self):
+        self.assertFalse(hasattr(collector, "GITHUB_TOKEN"))
+        self.assertFalse(hasattr(collector, "GITHUB_API_URL"))
+
+    def test_first_run_downloads_collected_markdown(self):
+        self.github.set_files(
+            {
+                "docs/intro.md": "intro",
+                "docs/guide/setup.md": "setup",
+                "docs/a/b/c/too_deep.md": "deep",
+                "docs/logo.png": "png",
+                "README.md": "readme",
+            }
+        )
+        entry, changes = self.collect({})
+
+        self.assertEqual(
+            sorted(changes["added"]),
+            ["handbook/docs_guide_setup.md", "handbook/docs_intro.md"],
+        )
+        self.assertEqual(entry["etag"], self.github.etag)
+        self.assertEqual(
+            entry["files"]["docs_intro.md"], {"path": "docs/intro.md", "sha": "sha-intro"}
+        )
+        with open(self.local("docs_intro.md"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "intro")
+
+    def test_unchanged_tree_is_a_conditional_304(self):
+        self.github.set_files({"docs/intro.md": "intro"})
+        entry, _ = self.collect({})
+        self.github.requests.clear()
+
+        second, changes = self.collect(entry)
+
+        tree_path, headers = self.github.requests[0]
+        self.assertIn("/git/trees/", tree_path)
+        self.assertEqual(headers["If-None-Match"], entry["etag"])
+        self.assertEqual(self.github.blob_requests(), [])
+        self.assertEqual(changes["unchanged"], 1)
+        self.assertEqual(second, entry)
+
+    def test_manifest_diff_between_runs(self):
+        self.github.set_files(
+            {"docs/keep.md": "keep", "docs/edit.md": "v1", "docs/drop.md": "drop"}
+        )
+        entry, _ = self.collect({})
+        self.github.requests.clear()
+
+        self.github.set_files(
+            {"docs/keep.md": "keep", "docs/edit.md": "v2", "docs/new.md": "new"}
+        )
+        second, changes = self.collect(entry)
+
+        self.assertEqual(changes["added"], ["handbook/docs_new.md"])
+        self.assertEqual(changes["modified"], ["handbook/docs_edit.md"])
+        self.assertEqual(changes["removed"], ["handbook/docs_drop.md"])
+        self.assertEqual(changes["unchanged"], 1)
+        # only the changed blobs are fetched
+        self.assertEqual(
+            sorted(self.github.blob_requests()),
+            [f"/repos/{REPO}/git/blobs/sha-new", f"/repos/{REPO}/git/blobs/sha-v2"],
+        )
+        self.assertFalse(os.path.exists(self.local("docs_drop.md")))
+        with open(self.local("docs_edit.md"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "v2")
+        self.assertEqual(second["etag"], self.github.etag)
+
+    def test_deleted_local_file_is_downloaded_again(self):
+        self.github.set_files({"docs/intro.md": "intro"})
+        entry, _ = self.collect({})
+        os.remove(self.local("docs_intro.md"))
+
+        # the tree is unchanged (304), but the file is missing on disk
+        _, changes = self.collect(entry)
+
+        self.assertEqual(changes["added"], ["handbook/docs_intro.md"])
+        self.assertTrue(os.path.exists(self.local("docs_intro.md")))
+
+    def test_failed_download_is_retried_next_run(self):
+        self.github.set_files({"docs/ok.md": "ok", "docs/broken.md": "broken"})
+        self.github.failing.add("sha-broken")
+        entry, changes = self.collect({})
+
+        self.assertEqual(changes["failed"], ["handbook/docs_broken.md"])
+        self.assertNotIn("docs_broken.md", entry["files"])
+        # no etag, so the next listing can't come back as a 304
+        self.assertIsNone(entry["etag"])
+
+        self.github.failing.clear()
+        self.github.requests.clear()
+        _, changes = self.collect(entry)
+
+        self.assertNotIn("If-None-Match", self.github.requests[0][1])
+        self.assertEqual(changes["added"], ["handbook/docs_broken.md"])
+        self.assertEqual(changes["unchanged"], 1)
+
+    def test_failed_listing_keeps_previous_files(self):
+        self.github.set_files({"docs/intro.md": "intro"})
+        entry, _ = self.collect({})
+
+        self.github.get = lambda url, headers=None, timeout=None: FakeResponse(404)
+        second, changes = self.collect(entry)
+
+        self.assertEqual(changes["removed"], [])
+        self.assertEqual(changes["unchanged"], 1)
+        self.assertEqual(second["files"], entry["files"])
+        self.assertIsNone(second["etag"])
+
+
+if __name__ == "__main__":
+    unittest.main()
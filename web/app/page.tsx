@@ -46,8 +46,13 @@ export default function Home() {
     setInput('')
     setIsLoading(true)
 
+    const assistantId = (Date.now() + 1).toString()
+    const updateAssistant = (update: (message: Message) => Message) => {
+      setMessages(prev => prev.map(m => (m.id === assistantId ? update(m) : m)))
+    }
+
     try {
-      const response = await fetch('/api/rag/query', {
+      const response = await fetch('/api/rag/query/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -58,18 +63,38 @@ export default function Home() {
         })
       })
 
-      if (!response.ok) throw new Error('Failed to get response')
-
-      const data = await response.json()
-
-      const assistantMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        role: 'assistant',
-        content: data.answer,
-        sources: data.sources
+      if (!response.ok || !response.body) throw new Error('Failed to get response')
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ''
+
+      // server-sent events: sources first, then one event per token
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+
+        buffer += decoder.decode(value, { stream: true })
+        const events = buffer.split('\n\n')
+        buffer = events.pop() ?? ''
+
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1]
+          const data = raw.match(/^data: (.*)$/m)?.[1]
+          if (!event || !data) continue
+
+          const payload = JSON.parse(data)
+          if (event === 'sources') {
+            setMessages(prev => [
+              ...prev,
+              { id: assistantId, role: 'assistant', content: '', sources: payload.sources }
+            ])
+            setIsLoading(false)
+          } else if (event === 'token') {
+            updateAssistant(m => ({ ...m, content: m.content + payload.token }))
+          }
+        }
       }
-
-      setMessages(prev => [...prev, assistantMessage])
     } catch (error) {
       console.error('Error:', error)
       const errorMessage: Message = {